@@ -0,0 +1,23 @@
+"""
+ASGI config for parking_system project - Production.
+
+Modo assíncrono: as páginas de leitura usam secoes.views_async. Exemplo:
+
+    uvicorn parking_system.asgi_backup:application --workers 2
+"""
+
+import os
+import sys
+
+# Add the project directory to the Python path
+# Substitua 'seu-username' pelo seu username do PythonAnywhere
+USERNAME = 'sysparkingcbmepi'  # ALTERE AQUI!
+path = f'/home/{USERNAME}/parking'
+if path not in sys.path:
+    sys.path.append(path)
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'parking_system.settings_prod')
+
+application = get_asgi_application()
@@ -0,0 +1,132 @@
+"""Caminho rápido de autenticação e permissões.
+
+CacheEmailBackend autentica pelo e-mail sem diferenciar maiúsculas (busca
+por LOWER(email), servida pelo índice funcional da migração 0008) e guarda o
+usuário no cache por AUTH_CACHE_TEMPO segundos, de modo que get_user() —
+chamado a cada requisição autenticada com o id da sessão — não consulta o
+banco. As permissões de cada usuário também ficam em cache.
+usuario_nos_grupos confere o tipo_usuario do usuário já carregado, como o
+GroupRequiredMixin, sem consultas.
+
+As entradas são removidas quando o usuário é salvo ou excluído e quando os
+grupos ou permissões dele mudam; mudanças nas permissões de um grupo valem
+ao expirar o cache. A remoção só alcança os demais workers se AUTH_CACHE for
+compartilhado (arquivo ou redis): com o locmem, que é por processo, o cache
+de usuários e permissões fica desligado, para que a troca de senha ou a
+desativação encerre a sessão em todos os workers na requisição seguinte.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.functions import Lower
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+User = get_user_model()
+
+VERSAO_CACHE = 1  # Incrementar ao mudar o formato dos objetos em cache
+
+
+def _cache():
+    return caches[getattr(settings, 'AUTH_CACHE', 'default')]
+
+
+def _cache_compartilhado():
+    return not isinstance(_cache(), LocMemCache)
+
+
+def _tempo_cache():
+    return getattr(settings, 'AUTH_CACHE_TEMPO', 5 * 60)
+
+
+def _chave_usuario(pk):
+    return f'auth:usuario:{pk}'
+
+
+def _chave_permissoes(pk):
+    return f'auth:permissoes:{pk}'
+
+
+class CacheEmailBackend(ModelBackend):
+    """Login por e-mail (ou username) e get_user() servido pelo cache"""
+
+    def authenticate(self, request, username=None, password=None, email=None, **kwargs):
+        login = email or username or kwargs.get(User.USERNAME_FIELD)
+        if not login or password is None:
+            return None
+        # LOWER(email) = login em minúsculas: usa o índice funcional
+        usuarios = list(User._default_manager.alias(email_minusculo=Lower('email')).filter(
+            email_minusculo=login.strip().lower()
+        ))
+        if len(usuarios) > 1:
+            # Cadastros antigos que diferem só na caixa: vale o e-mail exato
+            email = User._default_manager.normalize_email(login.strip())
+            usuarios = [usuario for usuario in usuarios if usuario.email == email]
+        if len(usuarios) != 1:
+            # Mesmo custo de um login válido, para não revelar quais e-mails existem
+            User().set_password(password)
+            return None
+        usuario = usuarios[0]
+        # check_password regrava o hash quando PASSWORD_HASHERS[0] muda,
+        # migrando as senhas antigas no próximo login de cada usuário
+        if usuario.check_password(password) and self.user_can_authenticate(usuario):
+            return usuario
+        return None
+
+    def get_user(self, user_id):
+        if not _cache_compartilhado():
+            return super().get_user(user_id)
+        chave = _chave_usuario(user_id)
+        usuario = _cache().get(chave, version=VERSAO_CACHE)
+        if usuario is None:
+            try:
+                usuario = User._default_manager.get(pk=user_id)
+            except User.DoesNotExist:
+                return None
+            _cache().set(chave, usuario, _tempo_cache(), version=VERSAO_CACHE)
+        return usuario if self.user_can_authenticate(usuario) else None
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not _cache_compartilhado():
+            return super().get_all_permissions(user_obj)
+        chave = _chave_permissoes(user_obj.pk)
+        permissoes = _cache().get(chave, version=VERSAO_CACHE)
+        if permissoes is None:
+            permissoes = super().get_all_permissions(user_obj)
+            _cache().set(chave, permissoes, _tempo_cache(), version=VERSAO_CACHE)
+        return permissoes
+
+
+def usuario_nos_grupos(user, grupos):
+    """True se o tipo_usuario do usuário está entre `grupos` (regra do GroupRequiredMixin)"""
+    return user.is_authenticated and getattr(user, 'tipo_usuario', None) in grupos
+
+
+def invalidar_usuario(pk):
+    _cache().delete_many([_chave_usuario(pk), _chave_permissoes(pk)], version=VERSAO_CACHE)
+
+
+@receiver([post_save, post_delete], sender=User, dispatch_uid='auth_cache_usuario')
+def invalidar_usuario_salvo(sender, instance, **kwargs):
+    invalidar_usuario(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through, dispatch_uid='auth_cache_grupos')
+@receiver(m2m_changed, sender=User.user_permissions.through, dispatch_uid='auth_cache_permissoes')
+def invalidar_grupos(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidar_usuario(instance.pk)
+    elif pk_set:
+        # Alteração feita pelo lado do grupo (grupo.user_set.add(...))
+        for pk in pk_set:
+            invalidar_usuario(pk)
+    else:
+        # grupo.user_set.clear(): pk_set não informa quem saiu
+        for pk in User._default_manager.values_list('pk', flat=True):
+            invalidar_usuario(pk)
@@ -0,0 +1,300 @@
+"""Backup incremental e compactado dos dados do sistema.
+
+Cada backup é um diretório em BACKUP_DIR com um manifest.json e, por modelo,
+partes NDJSON compactadas com gzip de até TAMANHO_PARTE objetos. As tabelas
+são lidas em ordem de pk com iterator(), sem carregar tudo na memória, todas
+dentro de uma única transação de leitura: o backup é um retrato do mesmo
+instante (termos não referenciam vagas ausentes). No SQLite essa transação é
+aberta com BEGIN DEFERRED, fora do atomic() (que usa o transaction_mode
+IMMEDIATE das configurações e seguraria o lock de escrita): no WAL ela só
+fixa o retrato de leitura e os operadores continuam gravando. Permissões, content types e
+sessões ficam de fora (são recriados pelo migrate); os arquivos em
+MEDIA_ROOT também.
+
+Todo backup grava também o estado de cada tabela: o pk e uma assinatura
+(hash) do conteúdo de cada linha. Um backup incremental (base=<nome de um
+backup anterior>) lê as tabelas inteiras, mas grava apenas as linhas novas
+ou cuja assinatura mudou desde a base, de modo que transferências e edições
+de placa, nome ou telefone entram mesmo sem uma data de alteração no modelo.
+
+A restauração aplica a cadeia (backup completo e incrementais) em ordem. Em
+cada modelo, primeiro remove as linhas ausentes do estado do backup (uma
+linha excluída pode guardar a placa ou o identificador que outra usa agora);
+depois as partes são descompactadas em processos de trabalho e inseridas com
+bulk_create (upsert pelo pk), uma transação por parte. Antes de cada parte,
+os valores das colunas únicas (placas, nome da seção, e-mail) que ela usa são
+retirados das linhas que os guardam no banco: com o destino em uso, uma placa
+pode ter mudado de vaga desde o backup. Como cada backup é um retrato
+consistente, toda linha afetada é regravada mais adiante na cadeia.
+
+    python manage.py shell -c "from secoes.backup import fazer_backup; fazer_backup()"
+    python manage.py shell -c "from secoes.backup import fazer_backup; fazer_backup(base='20250623_190000')"
+    python manage.py shell -c "from secoes.backup import restaurar; restaurar('20250624_190000')"
+
+Este módulo não importa modelos no topo, para que ler_parte possa ser
+executada em processos de trabalho sem o Django configurado.
+"""
+import gzip
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat
+from django.db.transaction import TransactionManagementError
+from django.utils import timezone
+
+TAMANHO_PARTE = 5000  # Objetos por arquivo
+TAMANHO_LOTE = 500  # Objetos por INSERT
+
+# Ordem de gravação e restauração: referenciados antes de quem referencia.
+# USUARIO é trocado por settings.AUTH_USER_MODEL (lido só na execução).
+USUARIO = 'usuario'
+MODELOS = ['auth.group', USUARIO, 'secoes.section', 'secoes.spot', 'secoes.termocompromisso']
+# Relações com permissões vão por chave natural: os pks de auth.permission
+# mudam de um banco para outro
+CHAVES_NATURAIS = {'auth.group', USUARIO}
+
+
+def _diretorio():
+    return getattr(settings, 'BACKUP_DIR', os.path.join(settings.BASE_DIR, 'backups'))
+
+
+def _label(label):
+    return settings.AUTH_USER_MODEL.lower() if label == USUARIO else label
+
+
+def _ler_manifesto(diretorio, nome):
+    with open(os.path.join(diretorio, nome, 'manifest.json'), encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+
+def _gravar_gzip(caminho, linhas):
+    temporario = f'{caminho}.tmp'
+    with gzip.open(temporario, 'wt', encoding='utf-8', compresslevel=6) as arquivo:
+        for linha in linhas:
+            arquivo.write(json.dumps(linha, cls=DjangoJSONEncoder, ensure_ascii=False))
+            arquivo.write('\n')
+    os.replace(temporario, caminho)
+
+
+def ler_parte(caminho):
+    """Executada no processo de trabalho: objetos de uma parte NDJSON compactada"""
+    with gzip.open(caminho, 'rt', encoding='utf-8') as arquivo:
+        return [json.loads(linha) for linha in arquivo]
+
+
+def _assinatura(linha):
+    conteudo = json.dumps(linha, cls=DjangoJSONEncoder, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(conteudo.encode(), digest_size=8).hexdigest()
+
+
+def _linhas_backup(modelo, naturais, estado_base, estado):
+    """Objetos serializados a gravar (todos, ou os alterados desde a base).
+
+    Acrescenta a `estado` o par [pk, assinatura] de cada linha da tabela.
+    """
+    queryset = modelo._base_manager.order_by('pk')
+    m2m = [campo.name for campo in modelo._meta.many_to_many]
+    if m2m:
+        queryset = queryset.prefetch_related(*m2m)
+    objetos = queryset.iterator(chunk_size=TAMANHO_LOTE)
+    while True:
+        lote = list(islice(objetos, TAMANHO_LOTE))
+        if not lote:
+            return
+        for linha in serializers.serialize('python', lote, use_natural_foreign_keys=naturais):
+            assinatura = _assinatura(linha)
+            estado.append([linha['pk'], assinatura])
+            if estado_base is None or estado_base.get(linha['pk']) != assinatura:
+                yield linha
+
+
+@contextmanager
+def _leitura_consistente():
+    """Transação de leitura com um único retrato do banco para todas as tabelas"""
+    if connection.vendor == 'sqlite':
+        # BEGIN DEFERRED à mão: não pega o lock de escrita (ver docstring)
+        if connection.in_atomic_block:
+            raise TransactionManagementError('O backup não pode rodar dentro de uma transação.')
+        with connection.cursor() as cursor:
+            cursor.execute('BEGIN DEFERRED')
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('ROLLBACK')
+        return
+
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            # No READ COMMITTED cada consulta veria um instante diferente
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+        yield
+
+
+def fazer_backup(nome=None, base=None, diretorio=None, progresso=None):
+    """Grava um backup completo (ou incremental sobre `base`) e retorna o nome.
+
+    progresso, se informado, é chamado com (modelo, objetos gravados).
+    """
+    diretorio = diretorio or _diretorio()
+    inicio = timezone.now()
+    nome = nome or timezone.localtime(inicio).strftime('%Y%m%d_%H%M%S')
+    destino = os.path.join(diretorio, nome)
+    os.makedirs(destino)
+    manifesto_base = _ler_manifesto(diretorio, base) if base else None
+
+    manifesto = {'nome': nome, 'inicio': inicio.isoformat(), 'base': base, 'modelos': {}}
+    with _leitura_consistente():
+        for label in MODELOS:
+            modelo = apps.get_model(_label(label))
+            estado_base = None
+            if manifesto_base is not None and _label(label) in manifesto_base['modelos']:
+                caminho_base = os.path.join(diretorio, base, manifesto_base['modelos'][_label(label)]['estado'])
+                estado_base = dict(ler_parte(caminho_base)[0])
+
+            estado = []
+            linhas = _linhas_backup(modelo, label in CHAVES_NATURAIS, estado_base, estado)
+            partes, total = [], 0
+            while True:
+                lote = list(islice(linhas, TAMANHO_PARTE))
+                if not lote:
+                    break
+                parte = f'{_label(label)}.{len(partes):04d}.ndjson.gz'
+                _gravar_gzip(os.path.join(destino, parte), lote)
+                partes.append(parte)
+                total += len(lote)
+                if progresso:
+                    progresso(_label(label), total)
+
+            # Estado completo da tabela: base do próximo incremental e lista de
+            # pks usada pela restauração para aplicar exclusões
+            arquivo_estado = f'{_label(label)}.estado.json.gz'
+            _gravar_gzip(os.path.join(destino, arquivo_estado), [estado])
+            manifesto['modelos'][_label(label)] = {
+                'partes': partes, 'objetos': total, 'linhas': len(estado), 'estado': arquivo_estado,
+            }
+
+    with open(os.path.join(destino, 'manifest.json'), 'w', encoding='utf-8') as arquivo:
+        json.dump(manifesto, arquivo, indent=2)
+    return nome
+
+
+def cadeia_backup(nome, diretorio=None):
+    """Manifestos do backup completo até `nome`, na ordem de aplicação"""
+    diretorio = diretorio or _diretorio()
+    cadeia = []
+    while nome:
+        manifesto = _ler_manifesto(diretorio, nome)
+        cadeia.append(manifesto)
+        nome = manifesto['base']
+    return cadeia[::-1]
+
+
+def _inserir(modelo, linhas):
+    """Upsert dos objetos pelo pk e substituição das relações muitos-para-muitos"""
+    objetos, relacoes = [], []
+    for deserializado in serializers.deserialize('python', linhas, handle_forward_references=False):
+        objetos.append(deserializado.object)
+        if deserializado.m2m_data:
+            relacoes.append((deserializado.object.pk, deserializado.m2m_data))
+
+    pk = modelo._meta.pk
+    campos = [campo.name for campo in modelo._meta.concrete_fields if not campo.primary_key]
+    _liberar_unicos(modelo, objetos)
+    modelo._base_manager.bulk_create(
+        objetos, batch_size=TAMANHO_LOTE, update_conflicts=True, unique_fields=[pk.name], update_fields=campos,
+    )
+
+    for campo in modelo._meta.many_to_many:
+        through = campo.remote_field.through
+        origem, destino = campo.m2m_field_name(), campo.m2m_reverse_field_name()
+        pks = [pk_objeto for pk_objeto, dados in relacoes if campo.name in dados]
+        through._base_manager.filter(**{f'{origem}__in': pks}).delete()
+        through._base_manager.bulk_create([
+            through(**{f'{origem}_id': pk_objeto, f'{destino}_id': alvo})
+            for pk_objeto, dados in relacoes
+            for alvo in dados.get(campo.name, ())
+        ], batch_size=TAMANHO_LOTE, ignore_conflicts=True)
+
+
+def _liberar_unicos(modelo, objetos):
+    """Retira os valores das colunas únicas usados pelos objetos de onde estão
+    gravados hoje (inclusive trocas dentro da própria parte).
+
+    Colunas que aceitam nulo ficam nulas; as demais recebem '#<pk>' até a
+    linha ser regravada.
+    """
+    for campo in modelo._meta.concrete_fields:
+        if not campo.unique or campo.primary_key:
+            continue
+        valores = list({getattr(objeto, campo.attname) for objeto in objetos} - {None, ''})
+        if campo.null:
+            provisorio = None
+        else:
+            provisorio = Concat(Value('#'), Cast('pk', output_field=CharField()), output_field=CharField())
+        for inicio in range(0, len(valores), TAMANHO_LOTE):
+            modelo._base_manager.filter(
+                **{f'{campo.attname}__in': valores[inicio:inicio + TAMANHO_LOTE]}
+            ).update(**{campo.attname: provisorio})
+
+
+def _remover_excluidos(modelo, caminho):
+    existentes = {pk for pk, _assinatura in ler_parte(caminho)[0]}
+    excluidos = [
+        pk for pk in modelo._base_manager.values_list('pk', flat=True).iterator(chunk_size=TAMANHO_PARTE)
+        if pk not in existentes
+    ]
+    for inicio in range(0, len(excluidos), TAMANHO_LOTE):
+        modelo._base_manager.filter(pk__in=excluidos[inicio:inicio + TAMANHO_LOTE]).delete()
+    return len(excluidos)
+
+
+def restaurar(nome, diretorio=None, workers=None, progresso=None):
+    """Aplica a cadeia de backups até `nome` no banco atual.
+
+    progresso, se informado, é chamado com (backup, modelo, objetos restaurados).
+    """
+    # cache_modelos importa os modelos: não pode ficar no topo (ver docstring)
+    from .cache_modelos import invalidar_cache
+
+    diretorio = diretorio or _diretorio()
+    workers = workers or getattr(settings, 'BACKUP_WORKERS', None)
+    modelos = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for manifesto in cadeia_backup(nome, diretorio):
+            origem = os.path.join(diretorio, manifesto['nome'])
+            for label, info in manifesto['modelos'].items():
+                modelo = apps.get_model(label)
+                modelos.append(modelo)
+                # Exclusões antes das inserções: uma linha removida pode ter a
+                # placa ou o identificador que uma linha do backup usa agora
+                with transaction.atomic():
+                    _remover_excluidos(modelo, os.path.join(origem, info['estado']))
+                total = 0
+                # Descompacta as partes em paralelo; a inserção segue a ordem das partes
+                caminhos = [os.path.join(origem, parte) for parte in info['partes']]
+                for linhas in executor.map(ler_parte, caminhos):
+                    with transaction.atomic():
+                        _inserir(modelo, linhas)
+                    total += len(linhas)
+                    if progresso:
+                        progresso(manifesto['nome'], label, total)
+
+    # Os pks vieram do backup: ajusta as sequências (PostgreSQL)
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), list(dict.fromkeys(modelos))):
+            cursor.execute(sql)
+    # bulk_create não dispara os sinais dos modelos
+    invalidar_cache()
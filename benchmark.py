@@ -0,0 +1,368 @@
+"""Benchmark dos caminhos mais usados do sistema.
+
+Gera uma frota sintética do CBMEPI (seções, vagas com placas, CPFs e nomes
+realistas, termos e histórico) em um banco de teste descartável e executa
+cenários roteirizados com o cliente de teste do Django, medindo latência
+(p50/p95/p99), número de consultas e pico de memória. O resultado é gravado
+em JSON para comparar execuções:
+
+    python manage.py shell -c "from secoes.benchmark import executar; executar('antes.json')"
+    python manage.py shell -c "from secoes.benchmark import comparar; comparar('antes.json', 'depois.json')"
+
+Teste de carga WSGI x ASGI: com o mesmo banco, suba o servidor em um dos
+modos, rode carga() com o cookie de sessão de um usuário logado e repita no
+outro modo; comparar_carga() mostra a vazão e as latências lado a lado.
+
+    gunicorn parking_system.wsgi_backup --workers 2 --threads 4
+    uvicorn parking_system.asgi_backup:application --workers 2
+    python manage.py shell -c "from secoes.benchmark import carga; carga('http://127.0.0.1:8000', 'wsgi.json', sessao='...')"
+"""
+import json
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .cache_modelos import invalidar_cache
+from .instrumentacao import percentil
+from .models import Section, Spot, TermoCompromisso
+
+NOMES = [
+    'José', 'João', 'Antônio', 'Francisco', 'Carlos', 'Paulo', 'Pedro', 'Lucas', 'Luiz', 'Marcos',
+    'Maria', 'Ana', 'Francisca', 'Antônia', 'Adriana', 'Juliana', 'Márcia', 'Fernanda', 'Patrícia', 'Aline',
+]
+SOBRENOMES = [
+    'Silva', 'Santos', 'Oliveira', 'Sousa', 'Lima', 'Pereira', 'Carvalho', 'Rodrigues', 'Almeida', 'Costa',
+    'Araújo', 'Ribeiro', 'Moura', 'Nascimento', 'Barbosa', 'Castelo Branco', 'Portela', 'Mendes', 'Rocha', 'Veloso',
+]
+MARCAS = {
+    'Fiat': ['Argo', 'Mobi', 'Strada', 'Toro'], 'Volkswagen': ['Gol', 'Polo', 'T-Cross', 'Saveiro'],
+    'Chevrolet': ['Onix', 'Tracker', 'S10', 'Spin'], 'Toyota': ['Corolla', 'Hilux', 'Yaris', 'SW4'],
+    'Hyundai': ['HB20', 'Creta'], 'Renault': ['Kwid', 'Duster'],
+}
+MOTOS = {'Honda': ['CG 160', 'Biz', 'Pop 110i', 'XRE 300'], 'Yamaha': ['Factor', 'Fazer', 'Lander']}
+CORES = ['Branco', 'Prata', 'Preto', 'Cinza', 'Vermelho', 'Azul']
+LETRAS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+REPETICOES = 20
+# Páginas consultadas pelos terminais das guaritas no teste de carga
+ROTAS_CARGA = [
+    ('secoes:dashboard', ''), ('secoes:spot_list', ''), ('secoes:spot_list', '?pesquisa=ABC'),
+    ('secoes:historico_vagas', ''),
+]
+
+
+def _placa(rng, usadas):
+    """Placa única: 70% no padrão Mercosul (ABC1D23), o resto no antigo (ABC-1234)"""
+    while True:
+        letras = ''.join(rng.choice(LETRAS) for _ in range(3))
+        if rng.random() < 0.7:
+            placa = f'{letras}{rng.randint(0, 9)}{rng.choice(LETRAS)}{rng.randint(0, 99):02d}'
+        else:
+            placa = f'{letras}-{rng.randint(0, 9999):04d}'
+        if placa not in usadas:
+            usadas.add(placa)
+            return placa
+
+
+def _cpf(rng):
+    """CPF com dígitos verificadores válidos, no formato 000.000.000-00"""
+    digitos = [rng.randint(0, 9) for _ in range(9)]
+    for tamanho in (9, 10):
+        soma = sum(d * peso for d, peso in zip(digitos, range(tamanho + 1, 1, -1)))
+        digitos.append((soma * 10 % 11) % 10)
+    d = ''.join(map(str, digitos))
+    return f'{d[:3]}.{d[3:6]}.{d[6:9]}-{d[9:]}'
+
+
+def gerar_frota(secoes=16, vagas=2000, fracao_historico=0.3, fracao_termos=0.6, semente=42):
+    """Cria seções e vagas sintéticas em lote; retorna (seções, vagas ativas, histórico)"""
+    rng = random.Random(semente)
+    agora = timezone.now()
+    nomes_secao = [nome for nome, _ in Section.NOME_CHOICES]
+    nomes_secao += [f'Seção Sintética {n}' for n in range(len(nomes_secao) + 1, secoes + 1)]
+
+    # Limites folgados para que o cenário de criação não esbarre na cota
+    limite = vagas // secoes + 10
+    lista_secoes = Section.objects.bulk_create([
+        Section(nome=nome, vagas_cobertas_nominadas=limite, vagas_cobertas_nao_nominadas=limite,
+                vagas_descobertas_nominadas=limite, vagas_descobertas_nao_nominadas=limite)
+        for nome in nomes_secao[:secoes]
+    ])
+
+    placas = set()
+    postos = [posto for posto, _ in Spot.POSTO_CHOICES]
+    historico = int(vagas * fracao_historico)
+    novas = []
+    for n in range(vagas + historico):
+        marca = rng.choice(list(MARCAS))
+        ocupada = rng.random() < 0.85
+        ativa = n < vagas
+        ocupacao = agora - timedelta(days=rng.randint(0, 365), minutes=rng.randint(0, 1440))
+        spot = Spot(
+            secao=rng.choice(lista_secoes),
+            tipo_cobertura=rng.choice(['coberta', 'descoberta']),
+            nominada=rng.choice(['nominada', 'nao_nominada']),
+            identificador=f'V{n + 1:05d}' if rng.random() < 0.9 else None,
+            ativo=ativa,
+            data_ocupacao=ocupacao,
+            data_saida=None if ativa else ocupacao + timedelta(days=rng.randint(1, 200)),
+        )
+        if ocupada or not ativa:
+            spot.nome_bombeiro = f'{rng.choice(NOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)}'
+            spot.posto_bombeiro = rng.choice(postos)
+            spot.matricula_bombeiro = f'{rng.randint(10000, 99999)}-{rng.randint(0, 9)}'
+            spot.cpf_bombeiro = _cpf(rng)
+            spot.placa_veiculo = _placa(rng, placas)
+            spot.marca_veiculo = marca
+            spot.modelo_veiculo = rng.choice(MARCAS[marca])
+            spot.cor_veiculo = rng.choice(CORES)
+            spot.ano_veiculo = rng.randint(2008, 2025)
+            spot.tipo_veiculo = 'carro'
+            if rng.random() < 0.15:
+                spot.placa_veiculo_adicional = _placa(rng, placas)
+            if rng.random() < 0.2:
+                marca_moto = rng.choice(list(MOTOS))
+                spot.placa_moto = _placa(rng, placas)
+                spot.marca_moto = marca_moto
+                spot.modelo_moto = rng.choice(MOTOS[marca_moto])
+            spot.status = 'ocupada'
+        novas.append(spot)
+
+    # data_ocupacao é auto_now_add: bulk_create grava a data atual, então as
+    # datas do histórico são aplicadas em seguida com bulk_update
+    ocupacoes = [spot.data_ocupacao for spot in novas]
+    with transaction.atomic():
+        criadas = Spot.objects.bulk_create(novas, batch_size=500)
+        for spot, ocupacao in zip(criadas, ocupacoes):
+            spot.data_ocupacao = ocupacao
+        Spot.objects.bulk_update(criadas, ['data_ocupacao'], batch_size=500)
+
+    termos = []
+    for spot in criadas:
+        if spot.nome_bombeiro and rng.random() < fracao_termos:
+            for aditamento in range(rng.choice([1, 1, 1, 2, 3])):
+                numero = 'Doc 01' if aditamento == 0 else f'Doc 01 - A{aditamento:02d}'
+                termos.append(TermoCompromisso(
+                    spot=spot, numero_documento=numero,
+                    arquivo=f'termos_compromisso_vagas/sintetico_{spot.pk}_{aditamento}.pdf',
+                ))
+    TermoCompromisso.objects.bulk_create(termos, batch_size=500)
+    invalidar_cache()
+    return len(lista_secoes), vagas, historico
+
+
+def _medir(cliente, metodo, url, repeticoes, dados=None, preparar=None, esperado=200, destino=None):
+    """Executa a requisição várias vezes e retorna latências, consultas e memória.
+
+    Toda resposta deve ter o status `esperado` (e, em redirecionamentos, ir
+    para `destino`): um formulário inválido (200) ou o redirecionamento para
+    o login seriam medidos como operações bem-sucedidas.
+    """
+    latencias, consultas, memoria = [], [], []
+    for _ in range(repeticoes):
+        argumentos = preparar() if preparar else (url, dados)
+        tracemalloc.start()
+        with CaptureQueriesContext(connection) as capturadas:
+            inicio = time.perf_counter()
+            response = getattr(cliente, metodo)(*argumentos)
+            if getattr(response, 'streaming', False):
+                for _ in response.streaming_content:
+                    pass
+            latencias.append((time.perf_counter() - inicio) * 1000)
+        memoria.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+        consultas.append(len(capturadas))
+        if response.status_code != esperado or (destino and response.get('Location') != destino):
+            raise RuntimeError(
+                f'{metodo.upper()} {argumentos[0]}: status {response.status_code} '
+                f'{response.get("Location", "")} (esperado {esperado} {destino or ""})'.rstrip()
+            )
+
+    return {
+        'status': response.status_code,
+        'repeticoes': repeticoes,
+        'p50_ms': round(percentil(latencias, 0.50), 2),
+        'p95_ms': round(percentil(latencias, 0.95), 2),
+        'p99_ms': round(percentil(latencias, 0.99), 2),
+        'max_ms': round(max(latencias), 2),
+        'consultas': max(consultas),
+        'pico_memoria_kb': round(max(memoria), 1),
+    }
+
+
+def _cenarios(cliente, repeticoes):
+    """Roteiro dos cenários; retorna {nome: métricas}"""
+    rng = random.Random(7)
+    ativas = list(Spot.objects.filter(ativo=True, status='ocupada').values_list('pk', 'placa_veiculo', 'nome_bombeiro'))
+    if len(ativas) <= repeticoes:
+        # liberar_vaga usa uma vaga ocupada por repetição, além da vaga do termo
+        raise ValueError(
+            f'Os cenários precisam de {repeticoes + 1} vagas ocupadas; a frota tem {len(ativas)}. '
+            'Aumente o número de vagas ou reduza as repetições.'
+        )
+    secao = Section.objects.order_by('pk').first()
+    hoje = timezone.localdate()
+    resultados = {}
+
+    resultados['dashboard'] = _medir(cliente, 'get', reverse('secoes:dashboard'), repeticoes)
+    resultados['lista_vagas'] = _medir(cliente, 'get', reverse('secoes:spot_list'), repeticoes)
+    resultados['lista_vagas_secao'] = _medir(
+        cliente, 'get', reverse('secoes:spot_list'), repeticoes, {'secao': secao.pk})
+    resultados['pesquisa_placa'] = _medir(
+        cliente, 'get', reverse('secoes:spot_list'), repeticoes, {'pesquisa': ativas[0][1][:5]})
+    resultados['pesquisa_nome'] = _medir(
+        cliente, 'get', reverse('secoes:spot_list'), repeticoes, {'pesquisa': ativas[0][2].split()[1]})
+
+    contador = iter(range(10 ** 6))
+
+    def nova_vaga():
+        n = next(contador)
+        return reverse('secoes:spot_create'), {
+            'secao': secao.pk, 'tipo_cobertura': 'coberta', 'nominada': 'nao_nominada',
+            'identificador': f'B{n:05d}', 'nome_bombeiro': f'Benchmark {n}', 'posto_bombeiro': 'cabo',
+            'placa_veiculo': f'BEN{n:04d}', 'tipo_veiculo': 'carro',
+        }
+    lista_vagas = reverse('secoes:spot_list')
+    resultados['criar_vaga'] = _medir(
+        cliente, 'post', None, repeticoes, preparar=nova_vaga, esperado=302, destino=lista_vagas)
+
+    # Cada repetição libera uma vaga ocupada diferente; a última fica para o termo
+    liberar = iter(rng.sample(ativas[:-1], repeticoes))
+    resultados['liberar_vaga'] = _medir(
+        cliente, 'post', None, repeticoes, esperado=302, destino=lista_vagas,
+        preparar=lambda: (reverse('secoes:liberar_vaga', args=[next(liberar)[0]]), {}))
+
+    resultados['historico'] = _medir(cliente, 'get', reverse('secoes:historico_vagas'), repeticoes)
+    resultados['historico_periodo'] = _medir(
+        cliente, 'get', reverse('secoes:historico_vagas'), repeticoes,
+        {'data_inicio': (hoje - timedelta(days=90)).isoformat(), 'data_fim': hoje.isoformat()})
+
+    # PDFs: a primeira execução renderiza (fria); as seguintes vêm do cache em disco
+    termo = reverse('secoes:gerar_termo', args=[ativas[-1][0]])
+    resultados['termo_pdf_frio'] = _medir(cliente, 'get', termo, 1)
+    resultados['termo_pdf_cache'] = _medir(cliente, 'get', termo, repeticoes)
+    lista = reverse('secoes:gerar_lista_vagas')
+    resultados['lista_pdf_frio'] = _medir(cliente, 'get', lista, 1)
+    resultados['lista_pdf_cache'] = _medir(cliente, 'get', lista, repeticoes)
+    return resultados
+
+
+def executar(arquivo='benchmark.json', secoes=16, vagas=2000, repeticoes=REPETICOES, semente=42):
+    """Cria um banco de teste, gera a frota, roda os cenários e grava o JSON"""
+    nome_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with tempfile.TemporaryDirectory() as diretorio_pdf, override_settings(
+            PDF_CACHE_DIR=diretorio_pdf, PDF_ESPERA_SEGUNDOS=600, ALLOWED_HOSTS=['*'],
+        ):
+            inicio = time.perf_counter()
+            total_secoes, total_vagas, historico = gerar_frota(secoes, vagas, semente=semente)
+            tempo_geracao = time.perf_counter() - inicio
+
+            usuario = get_user_model().objects.create_user(
+                email='benchmark@cbmepi.local', password=None, tipo_usuario='admin',
+                first_name='Benchmark', last_name='CBMEPI',
+            )
+            cliente = Client()
+            cliente.force_login(usuario)
+            resultados = _cenarios(cliente, repeticoes)
+    finally:
+        connection.creation.destroy_test_db(nome_original, verbosity=0)
+
+    relatorio = {
+        'data': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'banco': connection.vendor,
+        'frota': {'secoes': total_secoes, 'vagas': total_vagas, 'historico': historico,
+                  'geracao_s': round(tempo_geracao, 2)},
+        'cenarios': resultados,
+    }
+    with open(arquivo, 'w', encoding='utf-8') as saida:
+        json.dump(relatorio, saida, ensure_ascii=False, indent=2)
+    return relatorio
+
+
+def comparar(antes, depois, metrica='p95_ms'):
+    """Imprime a variação de uma métrica entre duas execuções gravadas"""
+    with open(antes, encoding='utf-8') as arquivo:
+        a = json.load(arquivo)['cenarios']
+    with open(depois, encoding='utf-8') as arquivo:
+        b = json.load(arquivo)['cenarios']
+    for nome in sorted(set(a) & set(b)):
+        va, vb = a[nome][metrica], b[nome][metrica]
+        variacao = (vb - va) / va * 100 if va else 0.0
+        print(f'{nome:24} {va:10.2f} -> {vb:10.2f} ({variacao:+.1f}%)  '
+              f'consultas {a[nome]["consultas"]} -> {b[nome]["consultas"]}')
+
+
+def _terminal(url_base, caminhos, sessao, fim):
+    """Um terminal: percorre os caminhos em sequência até o fim do teste"""
+    abridor = urllib.request.build_opener()
+    if sessao:
+        abridor.addheaders = [('Cookie', f'sessionid={sessao}')]
+    latencias, erros, n = [], 0, 0
+    while time.perf_counter() < fim:
+        caminho = caminhos[n % len(caminhos)]
+        n += 1
+        inicio = time.perf_counter()
+        try:
+            with abridor.open(url_base + caminho, timeout=30) as response:
+                response.read()
+        except (urllib.error.URLError, OSError):
+            erros += 1
+            continue
+        latencias.append((time.perf_counter() - inicio) * 1000)
+    return latencias, erros
+
+
+def carga(url_base, arquivo='carga.json', caminhos=None, terminais=30, duracao=30, sessao=None):
+    """Simula `terminais` operadores simultâneos contra um servidor em execução.
+
+    Cada terminal faz requisições em sequência durante `duracao` segundos;
+    grava e retorna a vazão (requisições/s), as latências e os erros.
+    """
+    caminhos = caminhos or [reverse(rota) + consulta for rota, consulta in ROTAS_CARGA]
+    fim = time.perf_counter() + duracao
+    with ThreadPoolExecutor(max_workers=terminais) as executor:
+        resultados = list(executor.map(
+            lambda _: _terminal(url_base.rstrip('/'), caminhos, sessao, fim), range(terminais)
+        ))
+
+    latencias = [latencia for parcial, _ in resultados for latencia in parcial]
+    relatorio = {
+        'data': timezone.now().isoformat(),
+        'url': url_base,
+        'terminais': terminais,
+        'duracao_s': duracao,
+        'requisicoes': len(latencias),
+        'erros': sum(erros for _, erros in resultados),
+        'requisicoes_s': round(len(latencias) / duracao, 1),
+        'p50_ms': round(percentil(latencias, 0.50), 2),
+        'p95_ms': round(percentil(latencias, 0.95), 2),
+        'p99_ms': round(percentil(latencias, 0.99), 2),
+    }
+    with open(arquivo, 'w', encoding='utf-8') as saida:
+        json.dump(relatorio, saida, ensure_ascii=False, indent=2)
+    return relatorio
+
+
+def comparar_carga(*arquivos):
+    """Imprime lado a lado os resultados de carga() (ex.: wsgi.json asgi.json)"""
+    for nome in arquivos:
+        with open(nome, encoding='utf-8') as arquivo:
+            r = json.load(arquivo)
+        print(f'{nome:16} {r["terminais"]:4} terminais  {r["requisicoes_s"]:8.1f} req/s  '
+              f'p50 {r["p50_ms"]:8.1f}  p95 {r["p95_ms"]:8.1f}  p99 {r["p99_ms"]:8.1f} ms  erros {r["erros"]}')
@@ -0,0 +1,195 @@
+"""Cache de leitura para seções e vagas.
+
+O catálogo de seções e cada vaga (com a seção) ficam no cache configurado em
+SECOES_CACHE (padrão: 'default'). As chaves levam um número de geração: ao
+alterar uma seção a geração é incrementada, invalidando o catálogo e todas as
+vagas em cache de uma vez; ao alterar uma vaga apenas a chave dela é removida.
+
+O mesmo cache guarda a versão dos dados (instante da última alteração, em
+ns): uma global e uma por seção, atualizadas a cada gravação de vaga, seção
+ou termo. As views condicionais (ETag/304) dependem apenas dela.
+
+As invalidações rodam após o commit da transação (transaction.on_commit):
+antes dele, um leitor concorrente guardaria os dados antigos sob a nova
+geração ou versão.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from django.http import Http404
+
+from .eventos import publicar_recarga
+from .models import Section, Spot, TermoCompromisso
+
+VERSAO_CACHE = 1  # Incrementar ao mudar o formato dos objetos em cache
+TEMPO_CACHE = 60 * 60
+CHAVE_GERACAO = 'secoes:geracao'
+CHAVE_VERSAO = 'secoes:versao'  # Qualquer alteração
+CHAVE_VERSAO_LOTE = 'secoes:versao:lote'  # Alterações que podem afetar todas as seções
+
+# Enviado após gravações em lote (invalidar_cache), para os demais caches
+# derivados dos dados (ex.: estatísticas do dashboard)
+dados_alterados = Signal()
+
+
+def _cache():
+    return caches[getattr(settings, 'SECOES_CACHE', 'default')]
+
+
+def geracao_cache():
+    # Valor inicial baseado no relógio: se a chave for descartada pelo cache,
+    # a nova geração não coincide com chaves antigas que ainda existam
+    return _cache().get_or_set(CHAVE_GERACAO, time.time_ns, None, version=VERSAO_CACHE)
+
+
+def _chave_vaga(pk):
+    return f'secoes:vaga:{pk}:{geracao_cache()}'
+
+
+def secoes_cadastradas():
+    """Lista de seções, lida do banco apenas quando alguma seção muda"""
+    chave = f'secoes:catalogo:{geracao_cache()}'
+    secoes = _cache().get(chave, version=VERSAO_CACHE)
+    if secoes is None:
+        secoes = list(Section.objects.all())
+        _cache().set(chave, secoes, TEMPO_CACHE, version=VERSAO_CACHE)
+    return secoes
+
+
+def obter_vaga(pk):
+    """Vaga com a seção carregada, ou Http404; use apenas para leitura"""
+    chave = _chave_vaga(pk)
+    spot = _cache().get(chave, version=VERSAO_CACHE)
+    if spot is None:
+        try:
+            spot = Spot.objects.select_related('secao').get(pk=pk)
+        except Spot.DoesNotExist:
+            raise Http404('Nenhuma vaga encontrada.')
+        _cache().set(chave, spot, TEMPO_CACHE, version=VERSAO_CACHE)
+    return spot
+
+
+async def ageracao_cache():
+    return await _cache().aget_or_set(CHAVE_GERACAO, time.time_ns, None, version=VERSAO_CACHE)
+
+
+async def asecoes_cadastradas():
+    """Versão assíncrona de secoes_cadastradas()"""
+    chave = f'secoes:catalogo:{await ageracao_cache()}'
+    secoes = await _cache().aget(chave, version=VERSAO_CACHE)
+    if secoes is None:
+        secoes = [secao async for secao in Section.objects.all()]
+        await _cache().aset(chave, secoes, TEMPO_CACHE, version=VERSAO_CACHE)
+    return secoes
+
+
+async def aobter_vaga(pk):
+    """Versão assíncrona de obter_vaga()"""
+    chave = f'secoes:vaga:{pk}:{await ageracao_cache()}'
+    spot = await _cache().aget(chave, version=VERSAO_CACHE)
+    if spot is None:
+        try:
+            spot = await Spot.objects.select_related('secao').aget(pk=pk)
+        except Spot.DoesNotExist:
+            raise Http404('Nenhuma vaga encontrada.')
+        await _cache().aset(chave, spot, TEMPO_CACHE, version=VERSAO_CACHE)
+    return spot
+
+
+def _chave_versao_secao(secao_id):
+    return f'{CHAVE_VERSAO}:secao:{secao_id}'
+
+
+def _chaves_versao(secao_id):
+    if secao_id:
+        return [CHAVE_VERSAO_LOTE, _chave_versao_secao(secao_id)]
+    return [CHAVE_VERSAO]
+
+
+def _versao(chaves, valores):
+    faltando = {chave: time.time_ns() for chave in chaves if chave not in valores}
+    if faltando:
+        # Chave descartada pelo cache: começa uma nova versão
+        _cache().set_many(faltando, None, version=VERSAO_CACHE)
+    return max({**valores, **faltando}.values())
+
+
+def versao_dados(secao_id=None):
+    """Instante (ns) da última alteração nos dados, ou na seção informada.
+
+    Uma única leitura do cache (get_many).
+    """
+    chaves = _chaves_versao(secao_id)
+    return _versao(chaves, _cache().get_many(chaves, version=VERSAO_CACHE))
+
+
+async def aversao_dados(secao_id=None):
+    """Versão assíncrona de versao_dados()"""
+    chaves = _chaves_versao(secao_id)
+    valores = await _cache().aget_many(chaves, version=VERSAO_CACHE)
+    faltando = {chave: time.time_ns() for chave in chaves if chave not in valores}
+    if faltando:
+        await _cache().aset_many(faltando, None, version=VERSAO_CACHE)
+    return max({**valores, **faltando}.values())
+
+
+def marcar_alteracao(*secao_ids):
+    """Nova versão global e das seções informadas"""
+    agora = time.time_ns()
+    versoes = {CHAVE_VERSAO: agora}
+    versoes.update({_chave_versao_secao(secao_id): agora for secao_id in secao_ids if secao_id})
+    _cache().set_many(versoes, None, version=VERSAO_CACHE)
+
+
+def invalidar_cache():
+    """Nova geração: invalida o catálogo e todas as vagas em cache.
+
+    Deve ser chamada após gravações em lote (bulk_create/bulk_update,
+    queryset.update), que não disparam os sinais dos modelos. Também gera
+    uma nova versão dos dados para todas as seções, envia dados_alterados e
+    pede às telas ao vivo que recarreguem. Tudo após o commit da transação
+    atual (de imediato, fora de uma transação).
+    """
+    transaction.on_commit(_nova_geracao)
+
+
+def _nova_geracao():
+    try:
+        _cache().incr(CHAVE_GERACAO, version=VERSAO_CACHE)
+    except ValueError:
+        geracao_cache()
+    agora = time.time_ns()
+    _cache().set_many({CHAVE_VERSAO: agora, CHAVE_VERSAO_LOTE: agora}, None, version=VERSAO_CACHE)
+    dados_alterados.send(sender=Spot)
+    publicar_recarga()
+
+
+@receiver([post_save, post_delete], sender=Section, dispatch_uid='secoes_cache_section')
+def invalidar_secoes(sender, **kwargs):
+    # As vagas em cache embutem a seção, então também são invalidadas
+    invalidar_cache()
+
+
+@receiver([post_save, post_delete], sender=Spot, dispatch_uid='secoes_cache_spot')
+def invalidar_vaga(sender, instance, **kwargs):
+    pk, secao_id = instance.pk, instance.secao_id
+
+    def invalidar():
+        _cache().delete(_chave_vaga(pk), version=VERSAO_CACHE)
+        marcar_alteracao(secao_id)
+
+    transaction.on_commit(invalidar)
+
+
+@receiver([post_save, post_delete], sender=TermoCompromisso, dispatch_uid='secoes_cache_termo')
+def invalidar_termo(sender, instance, **kwargs):
+    spot_id = instance.spot_id
+
+    def invalidar():
+        marcar_alteracao(Spot.objects.filter(pk=spot_id).values_list('secao_id', flat=True).first())
+
+    transaction.on_commit(invalidar)
@@ -0,0 +1,82 @@
+"""Respostas condicionais (ETag/Last-Modified) a partir da versão dos dados.
+
+dados_versionados() calcula um ETag forte com a versão dos dados (global ou
+da seção em ?secao=), o usuário e o token CSRF da sessão, e responde 304
+antes de a view consultar o banco ou renderizar templates. Só respostas 200
+levam ETag: páginas de espera (202) e redirecionamentos são sempre refeitos.
+
+As páginas usam Cache-Control: private, no-cache, então o navegador sempre
+revalida e a atualização sem mudanças custa uma leitura do cache.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.contrib import messages
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .cache_modelos import aversao_dados, versao_dados
+
+VERSAO_ETAG = 1  # Incrementar ao mudar templates, para descartar ETags antigos
+
+
+def _secao(request, secao_param):
+    valor = request.GET.get(secao_param) if secao_param else None
+    return int(valor) if valor and valor.isdigit() else None
+
+
+def _elegivel(request, usuario):
+    # Mensagens pendentes (ex.: após salvar) precisam ser exibidas na página
+    return (
+        request.method in ('GET', 'HEAD')
+        and usuario.is_authenticated
+        and not len(messages.get_messages(request))
+    )
+
+
+def _condicao(request, usuario, versao, extra):
+    """ETag e, se o cliente já tem esta versão, a resposta 304"""
+    partes = [VERSAO_ETAG, versao, usuario.pk, request.META.get('CSRF_COOKIE', ''), extra(request) if extra else None]
+    etag = quote_etag(hashlib.sha256(repr(partes).encode()).hexdigest()[:32])
+    return etag, get_conditional_response(request, etag=etag, last_modified=versao // 10 ** 9)
+
+
+def _finalizar(response, etag, versao):
+    if response.status_code == 200:
+        response.headers.setdefault('ETag', etag)
+        response.headers.setdefault('Last-Modified', http_date(versao // 10 ** 9))
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def dados_versionados(secao_param='secao', extra=None):
+    """Decorator de views (síncronas ou assíncronas) que depende apenas da versão dos dados.
+
+    extra(request), se informado, entra no ETag (ex.: o intervalo de tempo
+    dos contadores "últimos 7 dias" do dashboard).
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def _view(request, *args, **kwargs):
+                usuario = await request.auser()
+                if not _elegivel(request, usuario):
+                    return await view(request, *args, **kwargs)
+                versao = await aversao_dados(_secao(request, secao_param))
+                etag, nao_modificado = _condicao(request, usuario, versao, extra)
+                if nao_modificado is not None:
+                    return nao_modificado
+                return _finalizar(await view(request, *args, **kwargs), etag, versao)
+        else:
+            @wraps(view)
+            def _view(request, *args, **kwargs):
+                if not _elegivel(request, request.user):
+                    return view(request, *args, **kwargs)
+                versao = versao_dados(_secao(request, secao_param))
+                etag, nao_modificado = _condicao(request, request.user, versao, extra)
+                if nao_modificado is not None:
+                    return nao_modificado
+                return _finalizar(view(request, *args, **kwargs), etag, versao)
+        return _view
+    return decorator
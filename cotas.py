@@ -0,0 +1,47 @@
+"""Controle dos limites de vagas configurados em cada seção.
+
+A verificação bloqueia a linha da seção (SELECT ... FOR UPDATE) antes de
+contar as vagas ativas, de modo que cadastros simultâneos na mesma seção são
+serializados e não ultrapassam o limite. Vale para cadastros e para
+transferências (a seção de destino é a bloqueada). Deve ser chamada dentro de
+transaction.atomic(), junto com a gravação da vaga. No SQLite, onde o FOR
+UPDATE não existe, quem serializa é a própria transação: o transaction_mode
+IMMEDIATE faz o atomic() pegar o lock de escrita já no início.
+"""
+from django.core.exceptions import ValidationError
+
+from .models import Section, Spot
+
+MENSAGEM_LIMITE = 'Não é possível criar mais vagas deste tipo. Limite atingido: {limite}'
+
+
+def limite_vagas(secao, tipo_cobertura, nominada):
+    """Limite configurado na seção para o tipo de vaga"""
+    if tipo_cobertura == 'coberta' and nominada == 'nominada':
+        return secao.vagas_cobertas_nominadas
+    elif tipo_cobertura == 'coberta' and nominada == 'nao_nominada':
+        return secao.vagas_cobertas_nao_nominadas
+    elif tipo_cobertura == 'descoberta' and nominada == 'nominada':
+        return secao.vagas_descobertas_nominadas
+    return secao.vagas_descobertas_nao_nominadas
+
+
+def reservar_vaga(secao_id, tipo_cobertura, nominada):
+    """Bloqueia a seção e confirma que ainda há vaga ativa do tipo disponível.
+
+    Retorna a seção bloqueada; levanta ValidationError se o limite foi atingido.
+    """
+    secao = Section.objects.select_for_update().get(pk=secao_id)
+    limite = limite_vagas(secao, tipo_cobertura, nominada)
+    
+    # Contagem restrita às vagas da seção (índice da FK secao_id)
+    vagas_existentes = Spot.objects.filter(
+        secao_id=secao_id,
+        tipo_cobertura=tipo_cobertura,
+        nominada=nominada,
+        ativo=True  # Apenas vagas ativas
+    ).count()
+    
+    if vagas_existentes >= limite:
+        raise ValidationError(MENSAGEM_LIMITE.format(limite=limite))
+    return secao
@@ -0,0 +1,218 @@
+"""Canal de eventos de ocupação das vagas (alimenta o feed SSE).
+
+Cada gravação de Spot publica, após o commit, um delta compacto: vaga,
+seção, status e placa, com a seção e o status anteriores. Os assinantes
+(conexões SSE, uma fila asyncio cada) recebem apenas os eventos das seções
+assinadas; um cliente parado não custa nada além da sua fila.
+
+Por padrão o canal é do próprio processo. Com mais de um worker, configure
+EVENTOS_REDIS_URL: os eventos passam pelo pub/sub do Redis e cada processo
+com assinantes os repassa localmente.
+
+Gravações em lote (que não disparam sinais) publicam "recarregar", pedindo
+às telas que recarreguem a página.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Spot
+
+CANAL_REDIS = 'secoes:eventos:ocupacao'
+TAMANHO_FILA = 100  # Eventos pendentes por assinante antes de pedir recarga
+TAMANHO_HISTORICO = 200  # Eventos guardados para reconexões (Last-Event-ID)
+CAMPOS_ESTADO = ('secao_id', 'status', 'ativo')
+
+logger = logging.getLogger(__name__)
+
+
+class Assinatura:
+    """Fila de eventos de uma conexão, consumida no event loop dela"""
+
+    def __init__(self, loop, secoes):
+        self.loop = loop
+        self.secoes = secoes
+        self.fila = asyncio.Queue(maxsize=TAMANHO_FILA)
+
+    def interessa(self, evento):
+        if not self.secoes or evento['tipo'] != 'vaga':
+            return True
+        return evento['secao'] in self.secoes or evento.get('secao_anterior') in self.secoes
+
+    def entregar(self, evento):
+        # Executado no event loop da conexão
+        try:
+            self.fila.put_nowait(evento)
+        except asyncio.QueueFull:
+            # Cliente atrasado: descarta a fila e pede para recarregar
+            while not self.fila.empty():
+                self.fila.get_nowait()
+            self.fila.put_nowait({'id': evento['id'], 'tipo': 'recarregar'})
+
+
+class CanalOcupacao:
+    def __init__(self):
+        self._assinaturas = set()
+        self._historico = deque(maxlen=TAMANHO_HISTORICO)
+        self._lock = threading.Lock()
+        self._sequencia = 0
+        # Identifica o processo nos ids dos eventos: após um reinício os ids
+        # antigos não são confundidos com os novos
+        self._prefixo = uuid.uuid4().hex[:8]
+        self._redis = None
+        self._ouvinte = None
+
+    def _url_redis(self):
+        return getattr(settings, 'EVENTOS_REDIS_URL', None)
+
+    def _get_redis(self):
+        if self._redis is None:
+            import redis  # Dependência opcional, só com EVENTOS_REDIS_URL
+            self._redis = redis.Redis.from_url(self._url_redis())
+        return self._redis
+
+    def publicar(self, evento):
+        """Publica um evento (dicionário com 'tipo'); pode ser chamado de qualquer thread"""
+        if self._url_redis():
+            self._get_redis().publish(CANAL_REDIS, json.dumps(evento))
+        else:
+            self._distribuir(evento)
+
+    def _distribuir(self, evento):
+        with self._lock:
+            self._sequencia += 1
+            evento = {'id': f'{self._prefixo}-{self._sequencia}', **evento}
+            self._historico.append(evento)
+            assinaturas = [a for a in self._assinaturas if a.interessa(evento)]
+        for assinatura in assinaturas:
+            assinatura.loop.call_soon_threadsafe(assinatura.entregar, evento)
+
+    def _ouvir_redis(self):
+        # Qualquer falha (conexão, mensagem inválida) é registrada e a thread
+        # volta a assinar: se ela morresse, o processo pararia de repassar eventos
+        while True:
+            pubsub = None
+            try:
+                pubsub = self._get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CANAL_REDIS)
+                for mensagem in pubsub.listen():
+                    self._distribuir(json.loads(mensagem['data']))
+            except Exception:
+                logger.exception('Falha ao ouvir os eventos do Redis; assinando de novo')
+                # Eventos podem ter sido perdidos durante a falha: as telas recarregam
+                time.sleep(1)
+                self._distribuir({'tipo': 'recarregar'})
+            finally:
+                if pubsub is not None:
+                    pubsub.close()
+
+    def assinar(self, secoes=(), ultimo_id=None):
+        """Registra uma conexão; deve ser chamado dentro do event loop dela.
+
+        Retorna a assinatura e os eventos a reenviar desde ultimo_id. Se o id
+        não está mais no histórico, o reenvio é um pedido de recarga.
+        """
+        if self._url_redis():
+            with self._lock:
+                if self._ouvinte is None:
+                    self._ouvinte = threading.Thread(target=self._ouvir_redis, name='secoes-eventos', daemon=True)
+                    self._ouvinte.start()
+
+        assinatura = Assinatura(asyncio.get_running_loop(), frozenset(secoes))
+        with self._lock:
+            self._assinaturas.add(assinatura)
+            historico = list(self._historico)
+        if not ultimo_id:
+            return assinatura, []
+        ids = [evento['id'] for evento in historico]
+        if ultimo_id not in ids:
+            return assinatura, [{'id': historico[-1]['id'] if historico else ultimo_id, 'tipo': 'recarregar'}]
+        pendentes = historico[ids.index(ultimo_id) + 1:]
+        return assinatura, [evento for evento in pendentes if assinatura.interessa(evento)]
+
+    def cancelar(self, assinatura):
+        with self._lock:
+            self._assinaturas.discard(assinatura)
+
+
+canal_ocupacao = CanalOcupacao()
+
+
+def _status(spot):
+    return spot.status if spot.ativo else 'inativa'
+
+
+def _publicar_apos_commit(evento):
+    transaction.on_commit(lambda: canal_ocupacao.publicar(evento))
+
+
+def publicar_recarga():
+    """Pede às telas que recarreguem (após gravações em lote)"""
+    _publicar_apos_commit({'tipo': 'recarregar'})
+
+
+def _estado(instance):
+    # Lê o __dict__: um campo adiado (only/defer) não gera consulta aqui
+    valores = instance.__dict__
+    if any(campo not in valores for campo in CAMPOS_ESTADO):
+        return None
+    return {campo: valores[campo] for campo in CAMPOS_ESTADO}
+
+
+@receiver(post_init, sender=Spot, dispatch_uid='eventos_spot_carregado')
+def guardar_estado_carregado(sender, instance, **kwargs):
+    # Seção e status como vieram do banco, para as telas ajustarem os contadores
+    instance._estado_anterior = _estado(instance) if instance.pk is not None else None
+
+
+@receiver(pre_save, sender=Spot, dispatch_uid='eventos_spot_anterior')
+def guardar_estado_anterior(sender, instance, raw=False, **kwargs):
+    # Só consulta o banco se a vaga foi carregada sem algum dos campos
+    if not raw and instance.pk is not None and getattr(instance, '_estado_anterior', None) is None:
+        instance._estado_anterior = sender._base_manager.filter(pk=instance.pk).values(
+            *CAMPOS_ESTADO
+        ).first()
+
+
+@receiver(post_save, sender=Spot, dispatch_uid='eventos_spot_salvo')
+def publicar_vaga(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    evento = {
+        'tipo': 'vaga',
+        'vaga': instance.pk,
+        'secao': instance.secao_id,
+        'status': _status(instance),
+        'placa': instance.placa_veiculo or instance.placa_veiculo_adicional or instance.placa_moto,
+        'secao_anterior': None,
+        'status_anterior': None,
+    }
+    anterior = getattr(instance, '_estado_anterior', None)
+    if anterior and not kwargs.get('created'):
+        evento['secao_anterior'] = anterior['secao_id']
+        evento['status_anterior'] = anterior['status'] if anterior['ativo'] else 'inativa'
+    # Próxima gravação da mesma instância compara com o estado gravado agora
+    instance._estado_anterior = _estado(instance)
+    _publicar_apos_commit(evento)
+
+
+@receiver(post_delete, sender=Spot, dispatch_uid='eventos_spot_removido')
+def publicar_remocao(sender, instance, **kwargs):
+    _publicar_apos_commit({
+        'tipo': 'vaga',
+        'vaga': instance.pk,
+        'secao': None,
+        'status': 'removida',
+        'placa': None,
+        'secao_anterior': instance.secao_id,
+        'status_anterior': _status(instance),
+    })
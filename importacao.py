@@ -0,0 +1,310 @@
+"""Importação e exportação de vagas em lote (CSV/XLSX).
+
+A importação lê o arquivo linha a linha, valida placas e limites das seções
+em memória contra conjuntos pré-carregados, valida os campos de cada linha
+(clean_fields) e grava com bulk_create/bulk_update em lotes, cada lote em sua
+própria transação. Erros são informados pelo número da linha. Na atualização
+de vagas existentes, apenas as colunas presentes no cabeçalho são gravadas.
+"""
+import csv
+import io
+import time
+from collections import Counter
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.db.models import Count
+from openpyxl import Workbook, load_workbook
+
+from .cache_modelos import invalidar_cache
+from .cotas import limite_vagas
+from .models import Section, Spot
+from .placas import CAMPOS_PLACA, normalizar_placa
+
+# Colunas aceitas no arquivo, na ordem usada pela exportação
+COLUNAS_VAGA = [
+    'id', 'secao', 'identificador', 'tipo_cobertura', 'nominada', 'ativo',
+    'nome_bombeiro', 'posto_bombeiro', 'matricula_bombeiro', 'cpf_bombeiro',
+    'telefone_bombeiro', 'email_bombeiro',
+    'placa_veiculo', 'modelo_veiculo', 'marca_veiculo', 'cor_veiculo', 'ano_veiculo', 'tipo_veiculo',
+    'placa_veiculo_adicional', 'modelo_veiculo_adicional', 'marca_veiculo_adicional',
+    'cor_veiculo_adicional', 'ano_veiculo_adicional', 'tipo_veiculo_adicional',
+    'placa_moto', 'modelo_moto', 'marca_moto', 'cor_moto', 'ano_moto',
+]
+CAMPOS_ANO = ['ano_veiculo', 'ano_veiculo_adicional', 'ano_moto']
+CAMPOS_ESCOLHA = {
+    'tipo_cobertura': dict(Spot.COBERTURA_CHOICES),
+    'nominada': dict(Spot.NOMINADA_CHOICES),
+    'posto_bombeiro': dict(Spot.POSTO_CHOICES),
+    'tipo_veiculo': dict(Spot.TIPO_VEICULO_CHOICES),
+    'tipo_veiculo_adicional': dict(Spot.TIPO_VEICULO_CHOICES),
+}
+# Campos das vagas existentes mantidos em memória (status, placas e cotas)
+CAMPOS_PRECARREGADOS = ['ativo', 'nome_bombeiro', *CAMPOS_PLACA]
+TAMANHO_LOTE = 500
+
+
+def ler_linhas(arquivo, nome_arquivo):
+    """Lê um CSV (separado por ; ou ,) ou XLSX como dicionários, sem carregar tudo em memória"""
+    if nome_arquivo.lower().endswith('.xlsx'):
+        planilha = load_workbook(arquivo, read_only=True, data_only=True).active
+        linhas = planilha.iter_rows(values_only=True)
+        cabecalho = [str(c).strip() if c is not None else '' for c in next(linhas, [])]
+        for valores in linhas:
+            yield dict(zip(cabecalho, valores))
+        return
+
+    texto = io.TextIOWrapper(arquivo, encoding='utf-8-sig', newline='')
+    amostra = texto.read(4096)
+    texto.seek(0)
+    delimitador = ';' if amostra.count(';') > amostra.count(',') else ','
+    yield from csv.DictReader(texto, delimiter=delimitador)
+
+
+class ResultadoImportacao:
+    """Resumo de uma importação: contadores, erros por linha e vazão"""
+
+    def __init__(self):
+        self.criadas = 0
+        self.atualizadas = 0
+        self.erros = []  # (número da linha, mensagem)
+        self.segundos = 0.0
+
+    @property
+    def processadas(self):
+        return self.criadas + self.atualizadas + len(self.erros)
+
+    @property
+    def linhas_por_segundo(self):
+        return self.processadas / self.segundos if self.segundos else 0.0
+
+
+class ImportadorVagas:
+    """Valida e grava vagas em lote a partir de linhas de um arquivo"""
+
+    def __init__(self, tamanho_lote=TAMANHO_LOTE):
+        self.tamanho_lote = tamanho_lote
+        self.resultado = ResultadoImportacao()
+
+        # Estado pré-carregado para validar em memória
+        self.secoes = {secao.nome.strip().upper(): secao for secao in Section.objects.all()}
+        self.placas = {}
+        self.existentes = {}
+        for vaga in Spot.objects.values('pk', 'secao_id', 'tipo_cobertura', 'nominada', *CAMPOS_PRECARREGADOS).iterator():
+            self.existentes[vaga['pk']] = vaga
+            for campo in CAMPOS_PLACA:
+                if vaga[campo]:
+                    self.placas[normalizar_placa(vaga[campo])] = vaga['pk']
+        self.ocupacao = Counter({
+            (item['secao_id'], item['tipo_cobertura'], item['nominada']): item['total']
+            for item in Spot.objects.filter(ativo=True).values(
+                'secao_id', 'tipo_cobertura', 'nominada'
+            ).annotate(total=Count('pk'))
+        })
+
+        self.colunas = None  # Colunas presentes no cabeçalho do arquivo
+        self._novas = []  # (número da linha, vaga)
+        self._alteradas = []
+        self._liberadas = set()  # Placas retiradas de vagas no lote pendente
+
+    def _limpar(self, linha):
+        """Normaliza os valores da linha para os tipos dos campos"""
+        dados = {}
+        for coluna in COLUNAS_VAGA:
+            valor = linha.get(coluna)
+            if isinstance(valor, str):
+                valor = valor.strip()
+            dados[coluna] = None if valor in ('', None) else valor
+
+        for campo in CAMPOS_PLACA:
+            if dados[campo]:
+                dados[campo] = str(dados[campo]).upper()
+        for campo in CAMPOS_ANO + ['id']:
+            if dados[campo] is not None:
+                dados[campo] = int(dados[campo])
+        dados['ativo'] = str(dados['ativo']).lower() not in ('0', 'false', 'nao', 'não') if dados['ativo'] is not None else True
+        return dados
+
+    def _validar(self, dados):
+        """Retorna a mensagem de erro da linha, ou None se for válida"""
+        secao = self.secoes.get(str(dados['secao'] or '').upper())
+        if secao is None:
+            return f'Seção "{dados["secao"]}" não encontrada.'
+        dados['secao'] = secao
+
+        for campo, opcoes in CAMPOS_ESCOLHA.items():
+            if dados[campo] is not None and dados[campo] not in opcoes:
+                return f'{campo}: valor "{dados[campo]}" inválido.'
+        if not dados['tipo_cobertura'] or not dados['nominada']:
+            return 'tipo_cobertura e nominada são obrigatórios.'
+        if dados['id'] is not None and dados['id'] not in self.existentes:
+            return f'Vaga {dados["id"]} não encontrada.'
+
+        anterior = self.existentes.get(dados['id'])
+        if anterior:
+            # Colunas ausentes do arquivo mantêm os valores atuais da vaga
+            for campo in CAMPOS_PRECARREGADOS:
+                if campo not in self.colunas:
+                    dados[campo] = anterior[campo]
+
+        placas = [dados[campo] for campo in CAMPOS_PLACA if dados[campo]]
+        if len({normalizar_placa(placa) for placa in placas}) != len(placas):
+            return 'Não é permitido cadastrar a mesma placa em diferentes campos.'
+        for placa in placas:
+            dono = self.placas.get(normalizar_placa(placa))
+            if dono is not None and dono != dados['id']:
+                return f'A placa {placa} já está cadastrada no sistema.'
+
+        # Limite por seção para vagas ativas novas, reativadas ou que mudam de seção ou tipo
+        chave = (secao.pk, dados['tipo_cobertura'], dados['nominada'])
+        if dados['ativo'] and (not anterior or not anterior['ativo'] or chave != self._chave_cota(anterior)):
+            limite = limite_vagas(secao, dados['tipo_cobertura'], dados['nominada'])
+            if self.ocupacao[chave] >= limite:
+                return f'Limite de vagas deste tipo atingido na seção {secao.nome}: {limite}'
+        return None
+
+    @staticmethod
+    def _chave_cota(vaga):
+        return (vaga['secao_id'], vaga['tipo_cobertura'], vaga['nominada'])
+
+    def _montar(self, dados):
+        """Vaga da linha validada campo a campo (tamanho, tipo, e-mail, escolhas).
+
+        Retorna (vaga, None) ou (None, mensagem de erro).
+        """
+        spot = Spot(pk=dados['id'], secao=dados['secao'], **{
+            campo: valor for campo, valor in dados.items() if campo not in ('id', 'secao')
+        })
+        try:
+            # A seção já foi conferida em memória: excluí-la evita uma consulta por linha
+            spot.clean_fields(exclude=['secao'])
+        except ValidationError as e:
+            return None, '; '.join(
+                f'{campo}: {mensagem}' for campo, mensagens in e.message_dict.items() for mensagem in mensagens
+            )
+
+        # bulk_create/bulk_update não chamam Spot.save(): aplicar a regra de status
+        tem_veiculo = any(dados[campo] for campo in CAMPOS_PLACA)
+        spot.status = 'ocupada' if dados['nome_bombeiro'] and tem_veiculo else 'livre'
+        return spot, None
+
+    def _registrar(self, numero, dados, spot):
+        """Atualiza o estado em memória com a linha aceita e a coloca no lote"""
+        pk = dados['id']
+        anterior = self.existentes.get(pk)
+        novas_placas = {normalizar_placa(dados[campo]) for campo in CAMPOS_PLACA if dados[campo]}
+        if novas_placas & self._liberadas:
+            # A placa saiu de outra vaga no lote pendente: grava essa saída antes
+            # (as colunas de placa são únicas no banco)
+            self._gravar_lote()
+
+        if anterior:
+            for campo in CAMPOS_PLACA:
+                if anterior[campo] and anterior[campo] != dados[campo]:
+                    placa = normalizar_placa(anterior[campo])
+                    if self.placas.get(placa) == pk:
+                        del self.placas[placa]
+                        self._liberadas.add(placa)
+        for placa in novas_placas:
+            self.placas[placa] = pk or 0  # 0: vaga nova ainda sem pk
+
+        if anterior and anterior['ativo']:
+            self.ocupacao[self._chave_cota(anterior)] -= 1
+        if spot.ativo:
+            self.ocupacao[(spot.secao_id, spot.tipo_cobertura, spot.nominada)] += 1
+
+        if pk is None:
+            self._novas.append((numero, spot))
+        else:
+            self.existentes[pk] = {
+                'pk': pk, 'ativo': spot.ativo, 'secao_id': spot.secao_id,
+                'tipo_cobertura': spot.tipo_cobertura, 'nominada': spot.nominada,
+                **{campo: dados[campo] for campo in CAMPOS_PRECARREGADOS},
+            }
+            self._alteradas.append((numero, spot))
+        if len(self._novas) + len(self._alteradas) >= self.tamanho_lote:
+            self._gravar_lote()
+
+    def _gravar_lote(self):
+        # Atualizações gravam apenas as colunas presentes no arquivo
+        campos = [campo for campo in COLUNAS_VAGA if campo in self.colunas and campo not in ('id', 'secao')]
+        campos += ['secao', 'status']
+        novas = [spot for _numero, spot in self._novas]
+        alteradas = [spot for _numero, spot in self._alteradas]
+        try:
+            with transaction.atomic():
+                if alteradas:
+                    # Antes das novas: libera as placas que elas podem reutilizar
+                    Spot.objects.bulk_update(alteradas, campos, batch_size=self.tamanho_lote)
+                if novas:
+                    Spot.objects.bulk_create(novas, batch_size=self.tamanho_lote)
+        except DatabaseError as e:
+            # Lote inteiro recusado pelo banco; os anteriores já estão gravados
+            for numero, _spot in self._novas + self._alteradas:
+                self.resultado.erros.append((numero, f'Lote não gravado: {e}'))
+        else:
+            self.resultado.criadas += len(novas)
+            self.resultado.atualizadas += len(alteradas)
+        self._novas = []
+        self._alteradas = []
+        self._liberadas = set()
+
+    def importar(self, linhas):
+        """Processa as linhas e retorna o ResultadoImportacao"""
+        inicio = time.monotonic()
+        for numero, linha in enumerate(linhas, start=2):  # linha 1 é o cabeçalho
+            if self.colunas is None:
+                self.colunas = set(linha) & set(COLUNAS_VAGA)
+            try:
+                dados = self._limpar(linha)
+            except (TypeError, ValueError):
+                self.resultado.erros.append((numero, 'Valor numérico inválido.'))
+                continue
+            erro = self._validar(dados)
+            if erro is None:
+                spot, erro = self._montar(dados)
+            if erro:
+                self.resultado.erros.append((numero, erro))
+            else:
+                self._registrar(numero, dados, spot)
+        if self.colunas is not None:
+            self._gravar_lote()
+        if self.resultado.criadas or self.resultado.atualizadas:
+            invalidar_cache()
+        self.resultado.erros.sort()
+        self.resultado.segundos = time.monotonic() - inicio
+        return self.resultado
+
+
+def linhas_exportacao(queryset):
+    """Gera o cabeçalho e as linhas das vagas, percorrendo o queryset em blocos"""
+    yield COLUNAS_VAGA
+    campos = ['pk', 'secao__nome'] + COLUNAS_VAGA[2:]
+    yield from queryset.order_by('pk').values_list(*campos).iterator(chunk_size=TAMANHO_LOTE)
+
+
+class Echo:
+    """Objeto tipo arquivo que devolve o que recebe, para o csv.writer em streaming"""
+
+    def write(self, valor):
+        return valor
+
+
+def exportar_csv(queryset, linhas=linhas_exportacao):
+    """Gera o CSV linha a linha (para StreamingHttpResponse).
+
+    linhas gera o cabeçalho e as linhas a partir do queryset.
+    """
+    writer = csv.writer(Echo(), delimiter=';')
+    yield '\ufeff'  # BOM para o Excel reconhecer UTF-8
+    for linha in linhas(queryset):
+        yield writer.writerow(linha)
+
+
+def exportar_xlsx(queryset, arquivo, linhas=linhas_exportacao, titulo='Vagas'):
+    """Grava o XLSX em modo write_only, sem manter as linhas em memória"""
+    workbook = Workbook(write_only=True)
+    planilha = workbook.create_sheet(titulo)
+    for linha in linhas(queryset):
+        planilha.append(list(linha))
+    workbook.save(arquivo)
@@ -0,0 +1,265 @@
+"""Instrumentação de desempenho por requisição.
+
+O InstrumentacaoMiddleware mede, para cada requisição, o tempo total, a
+quantidade e o tempo das consultas ao banco (connection.execute_wrapper), o
+tempo de renderização de TemplateResponse e trechos marcados com medir() ou
+somados com somar_trecho() (ex.: renderização do PDF no processo de
+trabalho). Os números vão para estatísticas acumuladas por view, mantidas na
+memória do processo, e, com PERF_SERVER_TIMING ativo (padrão: DEBUG), para o
+cabeçalho Server-Timing. Requisições sem rota ficam todas em SEM_ROTA, para
+que varreduras de URLs não criem uma janela por caminho.
+
+Com PERF_PROFILER ativo, uma thread de amostragem coleta as pilhas das
+requisições em andamento a cada PERF_INTERVALO_AMOSTRA segundos; as pilhas
+das requisições acima de PERF_LIMITE_LENTA segundos são guardadas.
+
+O middleware funciona tanto no WSGI quanto no ASGI (views assíncronas).
+"""
+import contextvars
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+
+TAMANHO_JANELA = 200  # Requisições mantidas por view
+MAX_LENTAS = 20
+PROFUNDIDADE_PILHA = 25
+SEM_ROTA = '<sem rota>'
+
+_metricas_atuais = contextvars.ContextVar('secoes_metricas', default=None)
+
+
+class Metricas:
+    """Tempos coletados durante uma requisição"""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.tempo_db = 0.0
+        self.trechos = defaultdict(float)
+        # Escrito pela thread de amostragem e lido pela thread da requisição
+        self.amostras = Counter()
+        self._lock_amostras = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper: conta e cronometra cada consulta
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tempo_db += time.perf_counter() - inicio
+            self.consultas += 1
+
+    def amostrar(self, pilha):
+        with self._lock_amostras:
+            self.amostras[pilha] += 1
+
+    def pilhas_frequentes(self, n):
+        with self._lock_amostras:
+            return self.amostras.most_common(n)
+
+
+@contextmanager
+def medir(nome):
+    """Soma o tempo do bloco ao trecho `nome` da requisição atual, se houver"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        somar_trecho(nome, time.perf_counter() - inicio)
+
+
+def somar_trecho(nome, segundos):
+    """Soma um tempo medido em outro lugar (ex.: no processo de trabalho do PDF)"""
+    metricas = _metricas_atuais.get()
+    if metricas is not None:
+        metricas.trechos[nome] += segundos
+
+
+def percentil(valores, p):
+    """Percentil p (0 a 1) pelo método do posto mais próximo; 0.0 sem valores"""
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+class Estatisticas:
+    """Janela das últimas requisições por view e as requisições lentas"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._por_view = defaultdict(lambda: deque(maxlen=TAMANHO_JANELA))
+        self.lentas = deque(maxlen=MAX_LENTAS)
+
+    def registrar(self, view, duracao, metricas):
+        with self._lock:
+            self._por_view[view].append((duracao, metricas.consultas, metricas.tempo_db, dict(metricas.trechos)))
+
+    def registrar_lenta(self, view, caminho, duracao, metricas):
+        pilhas = [(' <- '.join(pilha), total) for pilha, total in metricas.pilhas_frequentes(5)]
+        with self._lock:
+            self.lentas.appendleft({
+                'view': view,
+                'caminho': caminho,
+                'duracao_ms': duracao * 1000,
+                'consultas': metricas.consultas,
+                'pilhas': pilhas,
+            })
+
+    def resumo(self):
+        """Lista de dicionários por view, ordenada pelo tempo total"""
+        with self._lock:
+            janelas = {view: list(janela) for view, janela in self._por_view.items()}
+        resumo = []
+        for view, registros in janelas.items():
+            duracoes = [r[0] for r in registros]
+            trechos = defaultdict(float)
+            for registro in registros:
+                for nome, tempo in registro[3].items():
+                    trechos[nome] += tempo
+            n = len(registros)
+            resumo.append({
+                'view': view,
+                'requisicoes': n,
+                'media_ms': sum(duracoes) / n * 1000,
+                'p95_ms': percentil(duracoes, 0.95) * 1000,
+                'max_ms': max(duracoes) * 1000,
+                'consultas_media': sum(r[1] for r in registros) / n,
+                'db_media_ms': sum(r[2] for r in registros) / n * 1000,
+                'trechos_media_ms': {nome: tempo / n * 1000 for nome, tempo in trechos.items()},
+                'total_ms': sum(duracoes) * 1000,
+            })
+        return sorted(resumo, key=lambda item: item['total_ms'], reverse=True)
+
+    def limpar(self):
+        with self._lock:
+            self._por_view.clear()
+            self.lentas.clear()
+
+
+class Amostrador(threading.Thread):
+    """Profiler por amostragem: lê as pilhas das threads com requisição ativa"""
+
+    def __init__(self, intervalo):
+        super().__init__(name='secoes-amostrador', daemon=True)
+        self.intervalo = intervalo
+        self.ativas = {}
+
+    def run(self):
+        while True:
+            time.sleep(self.intervalo)
+            frames = sys._current_frames()
+            for thread_id, metricas in list(self.ativas.items()):
+                frame = frames.get(thread_id)
+                pilha = []
+                while frame is not None and len(pilha) < PROFUNDIDADE_PILHA:
+                    codigo = frame.f_code
+                    pilha.append(f'{codigo.co_name} ({codigo.co_filename}:{frame.f_lineno})')
+                    frame = frame.f_back
+                if pilha:
+                    metricas.amostrar(tuple(pilha))
+
+
+estatisticas = Estatisticas()
+_amostrador = None
+_amostrador_lock = threading.Lock()
+
+
+def _get_amostrador():
+    global _amostrador
+    if not getattr(settings, 'PERF_PROFILER', False):
+        return None
+    with _amostrador_lock:
+        if _amostrador is None:
+            _amostrador = Amostrador(getattr(settings, 'PERF_INTERVALO_AMOSTRA', 0.01))
+            _amostrador.start()
+    return _amostrador
+
+
+class InstrumentacaoMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limite_lenta = getattr(settings, 'PERF_LIMITE_LENTA', 1.0)
+        # O cabeçalho expõe consultas e tempos a qualquer cliente
+        self.server_timing = getattr(settings, 'PERF_SERVER_TIMING', settings.DEBUG)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metricas = Metricas()
+        token = _metricas_atuais.set(metricas)
+        amostrador = _get_amostrador()
+        if amostrador is not None:
+            amostrador.ativas[threading.get_ident()] = metricas
+        try:
+            with connection.execute_wrapper(metricas):
+                response = self.get_response(request)
+        finally:
+            if amostrador is not None:
+                amostrador.ativas.pop(threading.get_ident(), None)
+            _metricas_atuais.reset(token)
+        return self._finalizar(request, response, metricas)
+
+    async def __acall__(self, request):
+        # No ASGI as consultas rodam na thread do sync_to_async da requisição
+        # (a mesma para toda a requisição): o wrapper é instalado na conexão
+        # dessa thread. O profiler por amostragem não se aplica aqui.
+        metricas = Metricas()
+        token = _metricas_atuais.set(metricas)
+
+        def instalar():
+            wrapper = connection.execute_wrapper(metricas)
+            wrapper.__enter__()
+            return wrapper
+
+        wrapper = await sync_to_async(instalar)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(wrapper.__exit__)(None, None, None)
+            _metricas_atuais.reset(token)
+        return self._finalizar(request, response, metricas)
+
+    def _finalizar(self, request, response, metricas):
+        duracao = time.perf_counter() - metricas.inicio
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else SEM_ROTA
+        estatisticas.registrar(view, duracao, metricas)
+        if duracao >= self.limite_lenta:
+            estatisticas.registrar_lenta(view, request.get_full_path(), duracao, metricas)
+
+        if self.server_timing:
+            response['Server-Timing'] = self._server_timing(duracao, metricas)
+        return response
+
+    def process_template_response(self, request, response):
+        # A renderização acontece logo depois deste hook
+        metricas = _metricas_atuais.get()
+        if metricas is not None:
+            inicio = time.perf_counter()
+
+            def fim_renderizacao(response):
+                metricas.trechos['template'] += time.perf_counter() - inicio
+
+            response.add_post_render_callback(fim_renderizacao)
+        return response
+
+    @staticmethod
+    def _server_timing(duracao, metricas):
+        partes = [
+            f'total;dur={duracao * 1000:.1f}',
+            f'db;dur={metricas.tempo_db * 1000:.1f};desc="{metricas.consultas} consultas"',
+        ]
+        partes += [f'{nome};dur={tempo * 1000:.1f}' for nome, tempo in metricas.trechos.items()]
+        return ', '.join(partes)
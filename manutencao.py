@@ -0,0 +1,125 @@
+"""Tarefas de manutenção em lote.
+
+Cada tarefa aplica um UPDATE baseado em conjunto sobre faixas de chave
+primária, uma transação por faixa, para não segurar o lock de escrita do
+SQLite por muito tempo. O progresso é gravado em um checkpoint para que uma
+execução interrompida continue de onde parou.
+"""
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, Max, Min, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cache_modelos import invalidar_cache
+from .models import Spot
+
+
+class Checkpoint:
+    """Último pk processado por tarefa, gravado em arquivo JSON"""
+
+    def __init__(self, caminho=None):
+        self.caminho = caminho or getattr(
+            settings, 'MANUTENCAO_CHECKPOINT', os.path.join(settings.BASE_DIR, 'manutencao_checkpoint.json')
+        )
+
+    def _ler(self):
+        try:
+            with open(self.caminho, encoding='utf-8') as arquivo:
+                return json.load(arquivo)
+        except (OSError, ValueError):
+            return {}
+
+    def obter(self, tarefa):
+        return self._ler().get(tarefa)
+
+    def salvar(self, tarefa, pk):
+        dados = self._ler()
+        if pk is None:
+            dados.pop(tarefa, None)
+        else:
+            dados[tarefa] = pk
+        temporario = f'{self.caminho}.tmp'
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump(dados, arquivo)
+        os.replace(temporario, self.caminho)
+
+
+class TarefaLote:
+    """Base das tarefas: subclasses definem queryset() e atualizar()"""
+
+    nome = None
+    descricao = ''
+    tamanho_faixa = 1000
+
+    def queryset(self):
+        raise NotImplementedError
+
+    def atualizar(self, queryset):
+        """Aplica a alteração na faixa e retorna o número de linhas afetadas"""
+        raise NotImplementedError
+
+    def executar(self, dry_run=False, retomar=True, tamanho_faixa=None, progresso=None, checkpoint=None):
+        """Percorre o queryset em faixas de pk e retorna o total de linhas afetadas.
+
+        progresso, se informado, é chamado com (fim da faixa, pk máximo, total).
+        Em dry_run apenas conta as linhas, sem alterar dados nem o checkpoint.
+        """
+        tamanho_faixa = tamanho_faixa or self.tamanho_faixa
+        checkpoint = checkpoint or Checkpoint()
+        queryset = self.queryset()
+
+        limites = queryset.aggregate(inicio=Min('pk'), fim=Max('pk'))
+        if limites['inicio'] is None:
+            return 0
+        inicio = limites['inicio']
+        ultimo = checkpoint.obter(self.nome) if retomar and not dry_run else None
+        if ultimo is not None:
+            inicio = max(inicio, ultimo + 1)
+
+        total = 0
+        while inicio <= limites['fim']:
+            fim = inicio + tamanho_faixa
+            faixa = queryset.filter(pk__gte=inicio, pk__lt=fim)
+            if dry_run:
+                total += faixa.count()
+            else:
+                with transaction.atomic():
+                    total += self.atualizar(faixa)
+                checkpoint.salvar(self.nome, fim - 1)
+            if progresso:
+                progresso(min(fim - 1, limites['fim']), limites['fim'], total)
+            inicio = fim
+
+        if not dry_run:
+            checkpoint.salvar(self.nome, None)
+            if total:
+                # UPDATE em lote não dispara sinais dos modelos
+                invalidar_cache()
+        return total
+
+
+class AtualizarDatasSaida(TarefaLote):
+    """Preenche data_saida das vagas inativas: data de ocupação + 1 dia, ou agora"""
+
+    nome = 'atualizar_datas_saida'
+    descricao = 'Atualiza a data de saída para vagas inativas que não possuem essa informação'
+
+    def queryset(self):
+        return Spot.objects.filter(ativo=False, data_saida__isnull=True)
+
+    def atualizar(self, queryset):
+        # data_saida não participa da regra de status do Spot.save(), então um
+        # UPDATE direto é equivalente a salvar vaga por vaga
+        return queryset.update(data_saida=Coalesce(
+            F('data_ocupacao') + timedelta(days=1),
+            Value(timezone.now()),
+            output_field=models.DateTimeField(),
+        ))
+
+
+TAREFAS = {tarefa.nome: tarefa for tarefa in [AtualizarDatasSaida]}
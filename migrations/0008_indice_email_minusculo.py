@@ -0,0 +1,30 @@
+# Índice funcional LOWER(email) no modelo de usuário, usado pelo login
+# sem diferenciar maiúsculas (secoes.autenticacao.CacheEmailBackend).
+# O modelo de usuário é de outro app (AUTH_USER_MODEL): o índice é criado
+# direto pelo schema_editor, sem alterar o estado do app contas.
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+INDICE = models.Index(Lower('email'), name='usuario_email_minusculo_idx')
+
+
+def criar_indice(apps, schema_editor):
+    schema_editor.add_index(apps.get_model(settings.AUTH_USER_MODEL), INDICE)
+
+
+def remover_indice(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model(settings.AUTH_USER_MODEL), INDICE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('secoes', '0007_spot_data_saida'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indice, remover_indice),
+    ]
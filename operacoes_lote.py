@@ -0,0 +1,137 @@
+"""Operações em lote sobre vagas: liberar, desativar e transferir.
+
+Cada operação seleciona as vagas por ids e/ou filtros, bloqueia as linhas,
+decide o resultado de cada vaga em memória e aplica a alteração com um único
+UPDATE, tudo na mesma transação. O retorno é um relatório por vaga.
+
+Na transferência a seção de destino fica bloqueada e as vagas que
+excederiam a cota do tipo (ver cotas.py) são recusadas no relatório.
+"""
+from django.db import models, transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cache_modelos import invalidar_cache
+from .cotas import MENSAGEM_LIMITE, limite_vagas
+from .models import Section, Spot
+
+# Campos limpos ao liberar a vaga (mesmos da view liberar_vaga)
+CAMPOS_OCUPANTE = [
+    'nome_bombeiro', 'posto_bombeiro', 'matricula_bombeiro', 'cpf_bombeiro', 'telefone_bombeiro', 'email_bombeiro',
+    'placa_veiculo', 'modelo_veiculo', 'marca_veiculo', 'cor_veiculo', 'ano_veiculo', 'tipo_veiculo',
+    'placa_veiculo_adicional', 'modelo_veiculo_adicional', 'marca_veiculo_adicional',
+    'cor_veiculo_adicional', 'ano_veiculo_adicional', 'tipo_veiculo_adicional',
+    'placa_moto', 'modelo_moto', 'marca_moto', 'cor_moto', 'ano_moto',
+]
+FILTROS_PERMITIDOS = ('secao', 'tipo_cobertura', 'nominada', 'status')
+
+
+class SelecaoVaziaError(ValueError):
+    """Nenhum id nem filtro informado: a operação atingiria todas as vagas"""
+
+
+def selecionar_vagas(ids=None, **filtros):
+    """Vagas ativas pelos ids e/ou filtros (secao, tipo_cobertura, nominada, status)"""
+    filtros = {campo: valor for campo, valor in filtros.items() if campo in FILTROS_PERMITIDOS and valor}
+    if not ids and not filtros:
+        raise SelecaoVaziaError('Informe as vagas ou ao menos um filtro.')
+    queryset = Spot.objects.filter(ativo=True, **filtros)
+    if ids:
+        queryset = queryset.filter(pk__in=ids)
+    return queryset
+
+
+def _item(pk, identificador, resultado, mensagem=''):
+    return {'id': pk, 'identificador': identificador, 'resultado': resultado, 'mensagem': mensagem}
+
+
+def _aplicar(queryset, decidir, atualizar, ids=None):
+    """Bloqueia as vagas, monta o relatório com decidir() e aplica um UPDATE nas aceitas"""
+    with transaction.atomic():
+        vagas = list(queryset.select_for_update().values(
+            'pk', 'identificador', 'status', 'secao_id', 'tipo_cobertura', 'nominada'
+        ))
+        relatorio = [decidir(vaga) for vaga in vagas]
+        aceitas = [item['id'] for item in relatorio if item['resultado'] == 'ok']
+        if aceitas:
+            Spot.objects.filter(pk__in=aceitas).update(**atualizar)
+
+    # ids pedidos que não estão entre as vagas ativas selecionadas
+    encontrados = {vaga['pk'] for vaga in vagas}
+    for pk in ids or ():
+        if pk not in encontrados:
+            relatorio.append(_item(pk, None, 'ignorada', 'Vaga inexistente, inativa ou fora do filtro.'))
+
+    if aceitas:
+        # UPDATE em lote não dispara sinais dos modelos (invalida após o commit)
+        invalidar_cache()
+    return relatorio
+
+
+def liberar_vagas(queryset, ids=None):
+    """Remove ocupante e veículos, marca como livre e registra a data de saída"""
+    def decidir(vaga):
+        if vaga['status'] == 'livre':
+            return _item(vaga['pk'], vaga['identificador'], 'ignorada', 'Vaga já está livre.')
+        return _item(vaga['pk'], vaga['identificador'], 'ok')
+
+    atualizar = {campo: None for campo in CAMPOS_OCUPANTE}
+    atualizar.update(status='livre', data_saida=timezone.now())
+    return _aplicar(queryset, decidir, atualizar, ids)
+
+
+def desativar_vagas(queryset, ids=None):
+    """Desativa as vagas, preservando os dados para o histórico"""
+    def decidir(vaga):
+        return _item(vaga['pk'], vaga['identificador'], 'ok')
+
+    atualizar = {
+        'ativo': False,
+        # Mantém a data de saída já registrada; senão, usa o momento da desativação
+        'data_saida': Coalesce(F('data_saida'), Value(timezone.now()), output_field=models.DateTimeField()),
+    }
+    return _aplicar(queryset, decidir, atualizar, ids)
+
+
+def transferir_vagas(queryset, nova_secao_id, ids=None):
+    """Move as vagas para outra seção, recusando identificadores já usados no destino
+    e vagas além da cota do tipo"""
+    with transaction.atomic():
+        # Seção de destino bloqueada até o fim da transferência
+        nova_secao = Section.objects.select_for_update().get(pk=nova_secao_id)
+        ativas = Spot.objects.filter(secao=nova_secao, ativo=True)
+        ocupados = set(ativas.filter(identificador__isnull=False).values_list('identificador', flat=True))
+        por_tipo = {
+            (linha['tipo_cobertura'], linha['nominada']): linha['total']
+            for linha in ativas.values('tipo_cobertura', 'nominada').annotate(total=Count('pk'))
+        }
+        decidir = _decisor_transferencia(nova_secao, ocupados, por_tipo)
+        return _aplicar(queryset, decidir, {'secao': nova_secao}, ids)
+
+
+def _decisor_transferencia(nova_secao, ocupados, por_tipo):
+    def decidir(vaga):
+        if vaga['secao_id'] == nova_secao.pk:
+            return _item(vaga['pk'], vaga['identificador'], 'ignorada', 'Vaga já pertence à seção.')
+        if vaga['identificador'] and vaga['identificador'] in ocupados:
+            return _item(vaga['pk'], vaga['identificador'], 'erro',
+                         f'Já existe uma vaga com o identificador "{vaga["identificador"]}" na seção {nova_secao.nome}.')
+        tipo = (vaga['tipo_cobertura'], vaga['nominada'])
+        limite = limite_vagas(nova_secao, *tipo)
+        if por_tipo.get(tipo, 0) >= limite:
+            return _item(vaga['pk'], vaga['identificador'], 'erro', MENSAGEM_LIMITE.format(limite=limite))
+        # Aceita: passa a contar para a cota e a ocupar o identificador no destino
+        por_tipo[tipo] = por_tipo.get(tipo, 0) + 1
+        if vaga['identificador']:
+            ocupados.add(vaga['identificador'])
+        return _item(vaga['pk'], vaga['identificador'], 'ok')
+
+    return decidir
+
+
+OPERACOES = {
+    'liberar': liberar_vagas,
+    'desativar': desativar_vagas,
+    'transferir': transferir_vagas,
+}
@@ -0,0 +1,362 @@
+"""Geração de PDFs em segundo plano com cache em disco.
+
+Os PDFs são renderizados pelo xhtml2pdf em um pool de processos e gravados
+em um diretório de cache endereçado pelo hash dos dados usados no documento.
+Pedidos repetidos para dados inalterados são servidos direto do disco.
+
+Relatórios grandes são renderizados em partes (arquivos HTML temporários):
+o xhtml2pdf, que é o que mais consome memória, processa uma parte por vez e
+grava o PDF dela em disco. As páginas são juntadas no final com o pypdf, que
+mantém na memória só os objetos já comprimidos do documento final (cerca de
+o tamanho do PDF), não o HTML nem a renderização de todas as partes.
+
+As chaves levam a data do documento, então um PDF deixa de ser pedido no
+máximo um dia depois de gerado: ao concluir um job, arquivos do diretório
+mais antigos que PDF_CACHE_TEMPO (padrão: 24 h) são removidos, no máximo uma
+vez por hora por processo.
+
+Templates e imagens dos relatórios ficam em cache no processo
+(RegistroRelatorios), recarregados apenas quando o arquivo muda.
+
+O tempo do xhtml2pdf é medido no processo de trabalho e somado ao trecho
+'pdf' da requisição que esperou o job; a espera na fila vai em 'pdf_espera'.
+
+Este módulo não importa modelos: as funções executadas nos processos de
+trabalho precisam ser importáveis sem o Django estar configurado.
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from pypdf import PdfWriter
+from xhtml2pdf import pisa
+
+from .instrumentacao import somar_trecho
+
+
+TEMPO_CACHE_PDF = 24 * 60 * 60
+INTERVALO_LIMPEZA = 60 * 60
+
+
+def renderizar_pdf(html):
+    """Converte o HTML em PDF e retorna os bytes do documento"""
+    result = BytesIO()
+    pdf = pisa.CreatePDF(html, result)
+    if pdf.err:
+        raise ValueError('Erro ao gerar PDF')
+    return result.getvalue()
+
+
+def _gravar_atomico(caminho, escrever):
+    """Grava em arquivo temporário e renomeia, para nunca servir um PDF parcial"""
+    fd, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as arquivo:
+            escrever(arquivo)
+        os.replace(temporario, caminho)
+    except BaseException:
+        os.unlink(temporario)
+        raise
+    return caminho
+
+
+def renderizar_pdf_em_arquivo(html, caminho):
+    """Executado no processo de trabalho: grava o PDF de forma atômica.
+
+    Retorna (caminho, segundos gastos na renderização).
+    """
+    inicio = time.perf_counter()
+    conteudo = renderizar_pdf(html)
+    duracao = time.perf_counter() - inicio
+    return _gravar_atomico(caminho, lambda arquivo: arquivo.write(conteudo)), duracao
+
+
+def renderizar_partes_em_arquivo(partes, caminho):
+    """Executado no processo de trabalho: renderiza cada parte HTML e junta as páginas.
+
+    Cada parte vira um PDF temporário em disco assim que é renderizada; a
+    junção é feita no final, a partir desses arquivos. Retorna (caminho,
+    segundos gastos na renderização).
+    """
+    pdfs = []
+    duracao = 0.0
+    try:
+        for parte in partes:
+            with open(parte, encoding='utf-8') as arquivo:
+                html = arquivo.read()
+            inicio = time.perf_counter()
+            conteudo = renderizar_pdf(html)
+            duracao += time.perf_counter() - inicio
+            del html
+            pdfs.append(_gravar_atomico(f'{parte}.pdf', lambda arquivo: arquivo.write(conteudo)))
+            del conteudo
+
+        writer = PdfWriter()
+        for pdf in pdfs:
+            writer.append(pdf)
+        return _gravar_atomico(caminho, writer.write), duracao
+    finally:
+        for arquivo in partes + pdfs:
+            if os.path.exists(arquivo):
+                os.unlink(arquivo)
+
+
+def chave_pdf(*partes):
+    """Gera a chave do cache a partir do template, versão e dados do documento.
+
+    Para relatórios com muitas vagas, use a versão dos dados
+    (cache_modelos.versao_dados) em vez das linhas: a chave sai sem consultas.
+    """
+    hasher = hashlib.sha256()
+    for parte in partes:
+        hasher.update(repr(parte).encode('utf-8'))
+        hasher.update(b'\0')
+    return hasher.hexdigest()
+
+
+def _copiar_resultado(origem, destino):
+    # O job retorna (caminho, duração); o futuro da fila expõe só o caminho
+    if origem.cancelled():
+        destino.cancel()
+    elif origem.exception() is not None:
+        destino.set_exception(origem.exception())
+    else:
+        caminho, destino.tempo_renderizacao = origem.result()
+        destino.set_result(caminho)
+
+
+def _somar_renderizacao(futuro):
+    somar_trecho('pdf', getattr(futuro, 'tempo_renderizacao', 0.0))
+
+
+class FilaPDF:
+    """Fila de renderização de PDFs compartilhada pelo processo web"""
+
+    def __init__(self):
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._ultima_limpeza = 0
+
+    @property
+    def diretorio(self):
+        diretorio = getattr(settings, 'PDF_CACHE_DIR', os.path.join(settings.BASE_DIR, 'pdf_cache'))
+        os.makedirs(diretorio, exist_ok=True)
+        return diretorio
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=getattr(settings, 'PDF_WORKERS', 2))
+            return self._executor
+
+    def _descartar_executor(self, executor):
+        """Um processo de trabalho morreu (ex.: OOM): o pool fica quebrado para
+        sempre; é descartado e recriado no próximo job"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submeter(self, renderizar, html, caminho):
+        executor = self._get_executor()
+        try:
+            trabalho = executor.submit(renderizar, html, caminho)
+        except BrokenProcessPool:
+            self._descartar_executor(executor)
+            executor = self._get_executor()
+            trabalho = executor.submit(renderizar, html, caminho)
+        return executor, trabalho
+
+    def _concluir(self, executor, trabalho, futuro):
+        if not trabalho.cancelled() and isinstance(trabalho.exception(), BrokenProcessPool):
+            self._descartar_executor(executor)
+        _copiar_resultado(trabalho, futuro)
+
+    def caminho(self, chave):
+        return os.path.join(self.diretorio, f'{chave}.pdf')
+
+    def obter(self, chave):
+        """Retorna o caminho do PDF já renderizado, ou None"""
+        caminho = self.caminho(chave)
+        return caminho if os.path.exists(caminho) else None
+
+    def gravar_parte(self, html):
+        """Grava uma parte HTML de um relatório e retorna o caminho temporário"""
+        fd, caminho = tempfile.mkstemp(dir=self.diretorio, suffix='.html')
+        with os.fdopen(fd, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(html)
+        return caminho
+
+    def enfileirar(self, chave, gerar_html, renderizar=renderizar_pdf_em_arquivo):
+        """Agenda a renderização; gerar_html só é chamado se não houver job em andamento.
+
+        Use renderizar=renderizar_partes_em_arquivo quando gerar_html retornar
+        a lista de partes gravadas com gravar_parte.
+        """
+        # O lock protege apenas o registro do job: o HTML (consultas e
+        # templates) é gerado fora dele, sem bloquear os outros documentos
+        with self._lock:
+            futuro = self._jobs.get(chave)
+            if futuro is not None:
+                return futuro
+            futuro = self._jobs[chave] = Future()
+        futuro.add_done_callback(lambda f: self._remover(chave, f))
+
+        try:
+            executor, trabalho = self._submeter(renderizar, gerar_html(), self.caminho(chave))
+        except Exception as e:
+            futuro.set_exception(e)
+        else:
+            trabalho.add_done_callback(lambda t: self._concluir(executor, t, futuro))
+        return futuro
+
+    def aguardar(self, chave, gerar_html, timeout, renderizar=renderizar_pdf_em_arquivo):
+        """Enfileira e espera até timeout segundos.
+
+        Retorna o caminho do PDF ou None se ainda estiver em processamento;
+        erros de renderização (ValueError do xhtml2pdf, OSError ao gravar ou
+        falha do processo de trabalho) são propagados.
+        """
+        inicio = time.perf_counter()
+        futuro = self.enfileirar(chave, gerar_html, renderizar)
+        try:
+            caminho = futuro.result(timeout=timeout)
+        except TimeoutError:
+            return None
+        finally:
+            somar_trecho('pdf_espera', time.perf_counter() - inicio)
+        _somar_renderizacao(futuro)
+        return caminho
+
+    async def aaguardar(self, chave, gerar_html, timeout, renderizar=renderizar_pdf_em_arquivo):
+        """Versão assíncrona de aguardar(): a espera não ocupa o event loop.
+
+        gerar_html (templates e consultas) roda em uma thread; a renderização
+        continua no pool de processos.
+        """
+        inicio = time.perf_counter()
+        futuro = await sync_to_async(self.enfileirar)(chave, gerar_html, renderizar)
+        try:
+            # shield: o timeout não cancela o job, que segue para o cache
+            caminho = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(futuro)), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            somar_trecho('pdf_espera', time.perf_counter() - inicio)
+        _somar_renderizacao(futuro)
+        return caminho
+
+    def _remover(self, chave, futuro):
+        with self._lock:
+            if self._jobs.get(chave) is futuro:
+                del self._jobs[chave]
+        self.limpar()
+
+    def limpar(self):
+        """Remove PDFs, partes e temporários mais antigos que PDF_CACHE_TEMPO"""
+        agora = time.time()
+        with self._lock:
+            if agora - self._ultima_limpeza < INTERVALO_LIMPEZA:
+                return
+            self._ultima_limpeza = agora
+        limite = agora - getattr(settings, 'PDF_CACHE_TEMPO', TEMPO_CACHE_PDF)
+        with os.scandir(self.diretorio) as entradas:
+            for entrada in entradas:
+                try:
+                    if entrada.is_file() and entrada.stat().st_mtime < limite:
+                        os.unlink(entrada.path)
+                except FileNotFoundError:
+                    pass  # Removido por outro processo
+
+
+fila_pdf = FilaPDF()
+
+
+class RegistroRelatorios:
+    """Cache por processo dos templates e imagens usados nos relatórios.
+
+    Cada item guarda o mtime do arquivo de origem e é recarregado quando o
+    arquivo muda; estatisticas conta acertos e falhas do cache.
+    """
+
+    def __init__(self):
+        self._imagens = {}
+        self._templates = {}
+        self._lock = threading.Lock()
+        self.estatisticas = {'acertos': 0, 'falhas': 0}
+
+    def _contar(self, chave):
+        with self._lock:
+            self.estatisticas[chave] += 1
+
+    @staticmethod
+    def _mtime(caminho):
+        try:
+            return os.stat(caminho).st_mtime if caminho else None
+        except OSError:
+            return -1
+
+    @staticmethod
+    def _localizar_estatico(nome):
+        """Procura nos STATICFILES_DIRS e, em seguida, na pasta static do projeto"""
+        diretorios = list(getattr(settings, 'STATICFILES_DIRS', []))
+        diretorios.append(os.path.join(settings.BASE_DIR, 'static'))
+        for diretorio in diretorios:
+            caminho = os.path.join(diretorio, nome)
+            if os.path.exists(caminho):
+                return caminho
+        return None
+
+    def imagem_base64(self, nome):
+        """Retorna a imagem estática codificada em base64 ('' se não existir)"""
+        item = self._imagens.get(nome)
+        if item is not None and self._mtime(item[0]) == item[1]:
+            self._contar('acertos')
+            return item[2]
+        
+        self._contar('falhas')
+        caminho = self._localizar_estatico(nome)
+        conteudo = ''
+        if caminho:
+            with open(caminho, 'rb') as arquivo:
+                conteudo = base64.b64encode(arquivo.read()).decode('utf-8')
+        self._imagens[nome] = (caminho, self._mtime(caminho), conteudo)
+        return conteudo
+
+    def template(self, nome):
+        """Retorna o template compilado, recompilando se o arquivo mudou"""
+        item = self._templates.get(nome)
+        if item is not None and self._mtime(item[0]) == item[1]:
+            self._contar('acertos')
+            return item[2]
+        
+        self._contar('falhas')
+        template = get_template(nome)
+        caminho = getattr(template.origin, 'name', None)
+        self._templates[nome] = (caminho, self._mtime(caminho), template)
+        return template
+
+    def precarregar(self, templates=(), imagens=()):
+        """Carrega os itens informados; templates ausentes falham só no uso"""
+        for nome in templates:
+            try:
+                self.template(nome)
+            except TemplateDoesNotExist:
+                pass
+        for nome in imagens:
+            self.imagem_base64(nome)
+
+
+registro_relatorios = RegistroRelatorios()
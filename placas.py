@@ -0,0 +1,42 @@
+"""Placas de veículos das vagas.
+
+As três colunas de placa (principal, adicional e moto) são únicas cada uma
+no banco. Só a importação (importacao.ImportadorVagas) compara as placas na
+forma normalizada (normalizar_placa, que ignora traço, espaço e caixa) e entre
+colunas; nos formulários vale a validação do modelo, com o valor como foi
+digitado.
+"""
+import re
+
+from django.db.models import Q
+
+CAMPOS_PLACA = ['placa_veiculo', 'placa_veiculo_adicional', 'placa_moto']
+# Placa completa na forma normalizada: ABC1234 ou Mercosul ABC1D23
+PLACA_COMPLETA = re.compile(r'[A-Z]{3}[0-9][0-9A-Z][0-9]{2}')
+
+
+def normalizar_placa(placa):
+    """Forma canônica da placa: maiúsculas, sem traço ou espaços"""
+    return re.sub(r'[^0-9A-Z]', '', placa.upper()) if placa else ''
+
+
+def grafias_placa(placa):
+    """Formas em que a placa pode estar gravada: sem separador, com traço ou
+    espaço, em maiúsculas ou minúsculas, além do próprio valor informado"""
+    normalizada = normalizar_placa(placa)
+    formas = {normalizada}
+    if len(normalizada) > 3:
+        formas |= {f'{normalizada[:3]}{separador}{normalizada[3:]}' for separador in ('-', ' ')}
+    return formas | {forma.lower() for forma in formas} | {placa.strip()}
+
+
+def filtro_placa_exata(termo):
+    """Filtro por igualdade nas três colunas de placa (servido pelos índices
+    únicos), ou None se o termo não é uma placa completa"""
+    if not PLACA_COMPLETA.fullmatch(normalizar_placa(termo)):
+        return None
+    grafias = grafias_placa(termo)
+    filtro = Q()
+    for campo in CAMPOS_PLACA:
+        filtro |= Q(**{f'{campo}__in': grafias})
+    return filtro
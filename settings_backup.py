@@ -14,12 +14,113 @@ ALLOWED_HOSTS = [f'{USERNAME}.pythonanywhere.com', f'www.{USERNAME}.pythonanywhe
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_PERFIL=sqlite (padrão) ou postgresql
+DB_PERFIL = os.environ.get('DB_PERFIL', 'sqlite')
+
+if DB_PERFIL == 'postgresql':
+    # Instalações maiores: conexões em pool (requer psycopg[pool])
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NOME', 'parking'),
+            'USER': os.environ.get('DB_USUARIO', 'parking'),
+            'PASSWORD': os.environ.get('DB_SENHA', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORTA', '5432'),
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DB_POOL_MIN', 2)),
+                    'max_size': int(os.environ.get('DB_POOL_MAX', 10)),
+                },
+            },
+        }
+    }
+else:
+    # SQLite em modo WAL: leituras não bloqueiam a escrita e vice-versa.
+    # Os PRAGMAs são aplicados a cada nova conexão. A espera pelo lock
+    # (busy timeout) é só o 'timeout', em segundos.
+    # Todo atomic() abre com BEGIN IMMEDIATE: pega o lock de escrita no início
+    # e espera por ele, em vez de falhar com "database is locked" ao passar
+    # de leitura para escrita. No SQLite o select_for_update não bloqueia
+    # nada; é isso que serializa a verificação de cota e a gravação da vaga.
+    # Por isso atomic() é só para transações que gravam: leituras longas
+    # em uma transação (backup) abrem com BEGIN DEFERRED (ver secoes.backup).
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA temp_store=MEMORY;'
+                    'PRAGMA cache_size=-20000;'
+                ),
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+            },
+        }
     }
+
+# Cache (catálogo de seções, vagas, versões dos dados, dashboard e usuários)
+# CACHE_PERFIL=arquivo (padrão), redis ou locmem. arquivo e redis são
+# compartilhados pelos workers, de modo que a invalidação feita por um vale
+# para todos. O locmem é por processo: use só com um único worker
+# (desenvolvimento).
+CACHE_PERFIL = os.environ.get('CACHE_PERFIL', 'arquivo')
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sysparking',
+    },
+    'arquivo': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        # Uma entrada por vaga: o padrão (300) descartaria o cache o tempo todo
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('CACHE_URL', 'redis://127.0.0.1:6379'),
+    },
 }
+CACHES = {'default': CACHE_BACKENDS[CACHE_PERFIL]}
+SECOES_CACHE = 'default'
+
+# Autenticação: login por e-mail e usuário/permissões em cache (AUTH_CACHE,
+# desligado se for um locmem, que não é compartilhado entre os workers).
+# Novas senhas usam o primeiro hasher da lista; as demais continuam válidas e
+# são regravadas com o primeiro no próximo login (PASSWORD_HASHER=argon2
+# requer argon2-cffi).
+AUTHENTICATION_BACKENDS = ['secoes.autenticacao.CacheEmailBackend']
+AUTH_CACHE = 'default'
+AUTH_CACHE_TEMPO = int(os.environ.get('AUTH_CACHE_TEMPO', 300))  # segundos
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+if os.environ.get('PASSWORD_HASHER') == 'argon2':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(2))
+
+# Backups incrementais (secoes.backup)
+BACKUP_DIR = os.environ.get('BACKUP_DIR', BASE_DIR / 'backups')
+BACKUP_WORKERS = int(os.environ.get('BACKUP_WORKERS', 2))  # processos na restauração
+
+# Feed ao vivo da ocupação (SSE, modo ASGI). Com mais de um worker, os
+# eventos passam pelo pub/sub do Redis
+EVENTOS_REDIS_URL = os.environ.get('EVENTOS_REDIS_URL')
+
+# Instrumentação de desempenho (Server-Timing e página de desempenho)
+MIDDLEWARE = ['secoes.instrumentacao.InstrumentacaoMiddleware'] + MIDDLEWARE
+PERF_LIMITE_LENTA = float(os.environ.get('PERF_LIMITE_LENTA', 1.0))  # segundos
+PERF_PROFILER = os.environ.get('PERF_PROFILER', '') == '1'
+PERF_INTERVALO_AMOSTRA = 0.01  # segundos entre amostras do profiler
+PERF_SERVER_TIMING = os.environ.get('PERF_SERVER_TIMING', '') == '1'  # expõe os tempos aos clientes
 
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = '/static/'
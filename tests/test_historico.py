@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import Section, Spot, TermoCompromisso
+
+
+class HistoricoConsultasTest(TestCase):
+    """A página do histórico custa o mesmo número de consultas para qualquer quantidade de vagas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = get_user_model().objects.create_user(
+            email='operador@cbm.pi.gov.br', password='senha-teste', tipo_usuario='usuario'
+        )
+        cls.secao = Section.objects.create(nome='Seção de Teste', vagas_cobertas_nominadas=100)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def criar_historico(self, inicio, quantidade):
+        vagas = Spot.objects.bulk_create([
+            Spot(secao=self.secao, tipo_cobertura='coberta', nominada='nominada',
+                 identificador=f'V{n:03d}', nome_bombeiro=f'Bombeiro {n}',
+                 ativo=False, data_saida=timezone.now())
+            for n in range(inicio, inicio + quantidade)
+        ])
+        TermoCompromisso.objects.bulk_create([
+            TermoCompromisso(spot=vaga, numero_documento=numero, arquivo=f'termos_compromisso_vagas/{vaga.pk}_{n}.pdf')
+            for vaga in vagas
+            for n, numero in enumerate(['Doc 01', 'Doc 01 - A01'])
+        ])
+
+    def test_consultas_constantes(self):
+        url = reverse('secoes:historico_vagas')
+        self.criar_historico(0, 2)
+        self.client.get(url)  # Aquece os caches de seções e versões
+        with CaptureQueriesContext(connection) as poucas:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.criar_historico(2, 30)
+        with self.assertNumQueries(len(poucas)):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['vagas_historico'].object_list), 32)
+        self.assertContains(response, '2 DOC(S)', count=32)
@@ -0,0 +1,56 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Section, Spot, TermoCompromisso
+
+
+class SpotListConsultasTest(TestCase):
+    """A página da lista de vagas custa o mesmo número de consultas para qualquer frota"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = get_user_model().objects.create_user(
+            email='operador@cbm.pi.gov.br', password='senha-teste', tipo_usuario='usuario'
+        )
+        cls.secao = Section.objects.create(nome='Seção de Teste', vagas_cobertas_nominadas=100)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def criar_vagas(self, inicio, quantidade):
+        vagas = Spot.objects.bulk_create([
+            Spot(secao=self.secao, tipo_cobertura='coberta', nominada='nominada',
+                 identificador=f'V{n:03d}', nome_bombeiro=f'Bombeiro {n}',
+                 placa_veiculo=f'ABC{n:04d}', status='ocupada')
+            for n in range(inicio, inicio + quantidade)
+        ])
+        TermoCompromisso.objects.bulk_create([
+            TermoCompromisso(spot=vaga, numero_documento='Doc 01', arquivo=f'termos_compromisso_vagas/{vaga.pk}.pdf')
+            for vaga in vagas
+        ])
+
+    def test_consultas_constantes(self):
+        url = reverse('secoes:spot_list')
+        self.criar_vagas(0, 2)
+        self.client.get(url)  # Aquece os caches de seções
+        with CaptureQueriesContext(connection) as poucas:
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.criar_vagas(2, 40)
+        with self.assertNumQueries(len(poucas)):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['spots']), 42)
+
+    def test_consultas_por_pagina(self):
+        url = reverse('secoes:spot_list')
+        self.criar_vagas(0, 60)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as primeira:
+            response = self.client.get(url)
+        self.assertTrue(response.context['page_obj'].has_next())
+
+        with self.assertNumQueries(len(primeira)):
+            self.client.get(url, {'depois': response.context['page_obj'].next_cursor})
@@ -0,0 +1,36 @@
+"""Armazenamento dos termos de compromisso enviados.
+
+Cada termo tem o seu arquivo, com o nome original do upload (o storage
+acrescenta um sufixo se o nome já existir), gravado antes da transação que
+numera e salva o termo. Uploads grandes chegam a um arquivo temporário, que
+o FileSystemStorage move para o destino sem nova cópia; os pequenos, em
+memória, são gravados em blocos.
+"""
+import os
+import re
+
+# Doc 01 (primeiro termo) ou Doc 01 - A<n> (aditamentos)
+NUMERO_DOCUMENTO = re.compile(r'Doc 01(?: - A(\d+))?')
+
+
+def armazenar_documento(termo):
+    """Grava o arquivo enviado do termo (ainda não salvo) e retorna o nome no storage"""
+    arquivo = termo.arquivo
+    arquivo.save(os.path.basename(arquivo.name), arquivo.file, save=False)
+    return arquivo.name
+
+
+def numerar_documento(spot):
+    """Próximo número do termo da vaga: Doc 01, Doc 01 - A01, Doc 01 - A02...
+
+    Segue o maior número entre os termos da vaga (e não a quantidade deles):
+    após a exclusão de um termo, o próximo número não repete o de outro termo.
+    Bloqueia a linha da vaga para que envios simultâneos não recebam o mesmo
+    número; deve ser chamada dentro de transaction.atomic(), junto com o save.
+    """
+    list(type(spot).objects.select_for_update().filter(pk=spot.pk).values_list('pk', flat=True))
+    numeros = spot.termos_compromisso.values_list('numero_documento', flat=True)
+    aditamentos = [int(numero.group(1) or 0) for numero in map(NUMERO_DOCUMENTO.fullmatch, numeros) if numero]
+    if not aditamentos:
+        return 'Doc 01'
+    return f'Doc 01 - A{max(aditamentos) + 1:02d}'
@@ -4,20 +4,38 @@ from django.urls import reverse_lazy
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, TemplateView
 from .models import Section, Spot, TermoCompromisso
 from .forms import SectionForm, SpotForm, TermoCompromissoForm
-from django.core.exceptions import ValidationError
-from django.db.models import Count, Q, Sum
-from datetime import datetime, timedelta
+from .autenticacao import usuario_nos_grupos
+from .cache_modelos import dados_alterados, secoes_cadastradas, obter_vaga, marcar_alteracao, versao_dados
+from .condicional import dados_versionados
+from .cotas import reservar_vaga
+from .importacao import ImportadorVagas, ler_linhas, exportar_csv, exportar_xlsx
+from .instrumentacao import estatisticas
+from .operacoes_lote import OPERACOES, SelecaoVaziaError, selecionar_vagas
+from .placas import filtro_placa_exata
+from .pdfs import fila_pdf, chave_pdf, renderizar_partes_em_arquivo, registro_relatorios
+from .uploads import armazenar_documento, numerar_documento
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db.models import Case, Count, F, Q, Sum, Prefetch, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from datetime import datetime, time, timedelta
 from django.contrib.auth.mixins import LoginRequiredMixin
 from contas.mixins import GroupRequiredMixin
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
-from django.template.loader import get_template
-from xhtml2pdf import pisa
-from io import BytesIO
+from django.http import HttpResponse, FileResponse, StreamingHttpResponse, JsonResponse
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.decorators import method_decorator
 import base64
-import os
-from django.db import models
+import json
+import logging
+import tempfile
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
 
 # Create your views here.
 
@@ -60,10 +78,134 @@ class SectionDeleteView(LoginRequiredMixin, GroupRequiredMixin, DeleteView):
         return super().delete(request, *args, **kwargs)
 
 # Views para Vagas
+
+# Colunas efetivamente exibidas na tabela de vagas (spot_list.html)
+CAMPOS_LISTA_VAGAS = [
+    'id', 'secao', 'secao__nome', 'identificador', 'ativo', 'status',
+    'tipo_cobertura', 'nominada',
+    'nome_bombeiro', 'posto_bombeiro', 'matricula_bombeiro', 'cpf_bombeiro',
+    'placa_veiculo', 'modelo_veiculo', 'marca_veiculo', 'cor_veiculo', 'ano_veiculo', 'tipo_veiculo',
+    'placa_veiculo_adicional', 'modelo_veiculo_adicional', 'marca_veiculo_adicional',
+    'cor_veiculo_adicional', 'ano_veiculo_adicional', 'tipo_veiculo_adicional',
+    'placa_moto', 'modelo_moto', 'marca_moto', 'cor_moto', 'ano_moto',
+]
+
+
+def prefetch_termos():
+    """Termos de cada vaga em uma consulta por página, só com as colunas exibidas"""
+    termos = TermoCompromisso.objects.only('id', 'spot_id', 'arquivo', 'numero_documento', 'data_upload')
+    return Prefetch('termos_compromisso', queryset=termos)
+
+
+class KeysetPage:
+    """Página de resultados paginada por cursor (sem COUNT nem OFFSET)"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        # Total de registros do filtro, quando conhecido (ex.: de um aggregate)
+        self.count = None
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def codificar_cursor(spot):
+    """Codifica a chave de ordenação de uma vaga em um cursor opaco para a URL"""
+    chave = [spot.secao_id, spot.identificador_ordem, spot.pk]
+    return base64.urlsafe_b64encode(json.dumps(chave).encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    """Decodifica o cursor da URL; retorna None se o valor for inválido"""
+    try:
+        secao_id, identificador, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(secao_id), str(identificador), int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def filtrar_cursor_vagas(queryset, depois, antes):
+    """Registros após (ou antes de) o cursor na ordem (secao, identificador, pk)"""
+    if antes:
+        secao_id, identificador, pk = antes
+        return queryset.filter(
+            Q(secao_id__lt=secao_id) |
+            Q(secao_id=secao_id, identificador_ordem__lt=identificador) |
+            Q(secao_id=secao_id, identificador_ordem=identificador, pk__lt=pk)
+        ).reverse()
+    if depois:
+        secao_id, identificador, pk = depois
+        return queryset.filter(
+            Q(secao_id__gt=secao_id) |
+            Q(secao_id=secao_id, identificador_ordem__gt=identificador) |
+            Q(secao_id=secao_id, identificador_ordem=identificador, pk__gt=pk)
+        )
+    return queryset
+
+
+def filtros_sem_cursor(request):
+    """Query string atual sem os parâmetros de cursor, para os links de paginação"""
+    filtros = request.GET.copy()
+    filtros.pop('depois', None)
+    filtros.pop('antes', None)
+    return filtros.urlencode()
+
+
+def montar_pagina(registros, tamanho, depois, antes, codificar):
+    """KeysetPage a partir de até tamanho + 1 registros lidos após o filtro do cursor"""
+    tem_mais = len(registros) > tamanho
+    registros = registros[:tamanho]
+    
+    if antes:
+        registros.reverse()
+        tem_proxima, tem_anterior = True, tem_mais
+    else:
+        tem_proxima, tem_anterior = tem_mais, bool(depois)
+    
+    return KeysetPage(
+        registros,
+        next_cursor=codificar(registros[-1]) if registros and tem_proxima else None,
+        previous_cursor=codificar(registros[0]) if registros and tem_anterior else None,
+    )
+
+
+def filtro_pesquisa_vagas(pesquisa):
+    """Filtro da pesquisa de vagas: trecho do nome, placa, matrícula ou CPF.
+
+    A busca por trecho (icontains) não usa índice e percorre as vagas; placas
+    completas são resolvidas antes por filtro_placa_exata (ver SpotListView).
+    """
+    return (
+        Q(nome_bombeiro__icontains=pesquisa) |
+        Q(placa_veiculo__icontains=pesquisa) |
+        Q(placa_veiculo_adicional__icontains=pesquisa) |
+        Q(placa_moto__icontains=pesquisa) |
+        Q(matricula_bombeiro__icontains=pesquisa) |
+        Q(cpf_bombeiro__icontains=pesquisa)
+    )
+
+
+@method_decorator(dados_versionados(), name='dispatch')
 class SpotListView(LoginRequiredMixin, ListView):
     model = Spot
     template_name = 'secoes/spot_list.html'
     context_object_name = 'spots'
+    paginate_by = 50
+    ordering = ('secao_id', 'identificador_ordem', 'pk')
 
     def get_queryset(self):
         # Verificar se deve mostrar vagas inativas
@@ -80,24 +222,40 @@ class SpotListView(LoginRequiredMixin, ListView):
             queryset = queryset.filter(secao_id=secao_id)
         
         # Filtro por pesquisa (placa ou nome do militar)
-        pesquisa = self.request.GET.get('pesquisa')
+        pesquisa = (self.request.GET.get('pesquisa') or '').strip()
         if pesquisa:
-            queryset = queryset.filter(
-                models.Q(nome_bombeiro__icontains=pesquisa) |
-                models.Q(placa_veiculo__icontains=pesquisa) |
-                models.Q(placa_veiculo_adicional__icontains=pesquisa) |
-                models.Q(placa_moto__icontains=pesquisa) |
-                models.Q(matricula_bombeiro__icontains=pesquisa) |
-                models.Q(cpf_bombeiro__icontains=pesquisa)
-            )
+            # Placa completa: igualdade nos índices únicos das placas; sem
+            # resultado, cai na busca por trecho em todos os campos
+            placa = filtro_placa_exata(pesquisa)
+            if placa is not None and queryset.filter(placa).exists():
+                queryset = queryset.filter(placa)
+            else:
+                queryset = queryset.filter(filtro_pesquisa_vagas(pesquisa))
+        
+        # Carregar seção e termos junto com a página, apenas com as colunas exibidas
+        return queryset.select_related('secao').prefetch_related(prefetch_termos()).only(*CAMPOS_LISTA_VAGAS).annotate(
+            # Vagas sem identificador entram no início de cada seção em qualquer banco
+            identificador_ordem=Coalesce('identificador', Value(''))
+        ).order_by(*self.ordering)
+
+    def paginate_queryset(self, queryset, page_size):
+        """Paginação por cursor: custo constante por página, sem COUNT nem OFFSET"""
+        depois = decodificar_cursor(self.request.GET.get('depois', ''))
+        antes = decodificar_cursor(self.request.GET.get('antes', ''))
         
-        return queryset
+        # Buscar um registro a mais para saber se existe outra página
+        queryset = filtrar_cursor_vagas(queryset, depois, antes)
+        page = montar_pagina(list(queryset[:page_size + 1]), page_size, depois, antes, codificar_cursor)
+        return None, page, page.object_list, page.has_other_pages()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['sections'] = Section.objects.all()
+        context['sections'] = secoes_cadastradas()
         context['mostrar_inativas'] = self.request.GET.get('mostrar_inativas') == 'true'
         context['pesquisa'] = self.request.GET.get('pesquisa', '')
+        
+        # Filtros atuais para manter nos links de paginação
+        context['filtros_url'] = filtros_sem_cursor(self.request)
         return context
 
 class SpotCreateView(LoginRequiredMixin, GroupRequiredMixin, CreateView):
@@ -113,39 +271,25 @@ class SpotCreateView(LoginRequiredMixin, GroupRequiredMixin, CreateView):
         tipo_cobertura = form.cleaned_data['tipo_cobertura']
         nominada = form.cleaned_data['nominada']
         
-        # Contar vagas existentes do mesmo tipo (apenas vagas ativas)
-        vagas_existentes = Spot.objects.filter(
-            secao=secao,
-            tipo_cobertura=tipo_cobertura,
-            nominada=nominada,
-            ativo=True  # Apenas vagas ativas
-        ).count()
-        
-        # Verificar limite baseado no tipo
-        if tipo_cobertura == 'coberta' and nominada == 'nominada':
-            limite = secao.vagas_cobertas_nominadas
-        elif tipo_cobertura == 'coberta' and nominada == 'nao_nominada':
-            limite = secao.vagas_cobertas_nao_nominadas
-        elif tipo_cobertura == 'descoberta' and nominada == 'nominada':
-            limite = secao.vagas_descobertas_nominadas
-        else:  # descoberta e não nominada
-            limite = secao.vagas_descobertas_nao_nominadas
-        
-        if vagas_existentes >= limite:
-            messages.error(self.request, f'Não é possível criar mais vagas deste tipo. Limite atingido: {limite}')
-            return self.form_invalid(form)
-        
-        # Validar o modelo antes de salvar
-        try:
-            form.instance.full_clean()
-        except ValidationError as e:
-            for field, errors in e.message_dict.items():
-                for error in errors:
-                    messages.error(self.request, f'{field}: {error}')
-            return self.form_invalid(form)
-        
-        messages.success(self.request, 'Vaga criada com sucesso!')
-        return super().form_valid(form)
+        # Verificação e gravação na mesma transação, com a seção bloqueada
+        with transaction.atomic():
+            try:
+                reservar_vaga(secao.pk, tipo_cobertura, nominada)
+            except ValidationError as e:
+                messages.error(self.request, e.messages[0])
+                return self.form_invalid(form)
+            
+            # Validar o modelo antes de salvar
+            try:
+                form.instance.full_clean()
+            except ValidationError as e:
+                for field, errors in e.message_dict.items():
+                    for error in errors:
+                        messages.error(self.request, f'{field}: {error}')
+                return self.form_invalid(form)
+            
+            messages.success(self.request, 'Vaga criada com sucesso!')
+            return super().form_valid(form)
 
 class SpotUpdateView(LoginRequiredMixin, GroupRequiredMixin, UpdateView):
     model = Spot
@@ -177,114 +321,309 @@ class SpotDeleteView(LoginRequiredMixin, GroupRequiredMixin, DeleteView):
         messages.success(request, 'Vaga excluída com sucesso!')
         return super().delete(request, *args, **kwargs)
 
+GRUPOS_EXPORTACAO = ['admin']  # Mesmos da importação: os arquivos levam CPF, telefone e e-mail
+
+
+class ImportarVagasView(LoginRequiredMixin, GroupRequiredMixin, TemplateView):
+    """Importação de vagas em lote a partir de planilha CSV ou XLSX"""
+    template_name = 'secoes/importar_vagas.html'
+    allowed_groups = ['admin']
+
+    def post(self, request, *args, **kwargs):
+        arquivo = request.FILES.get('arquivo')
+        if not arquivo or not arquivo.name.lower().endswith(('.csv', '.xlsx')):
+            messages.error(request, 'Envie um arquivo CSV ou XLSX.')
+            return self.render_to_response(self.get_context_data())
+        
+        resultado = ImportadorVagas().importar(ler_linhas(arquivo.file, arquivo.name))
+        
+        messages.success(
+            request,
+            f'{resultado.criadas} vaga(s) criada(s) e {resultado.atualizadas} atualizada(s) '
+            f'em {resultado.segundos:.1f}s ({resultado.linhas_por_segundo:.0f} linhas/s).'
+        )
+        if resultado.erros:
+            messages.warning(request, f'{len(resultado.erros)} linha(s) com erro não foram importadas.')
+        return self.render_to_response(self.get_context_data(resultado=resultado))
+
+@login_required
+def exportar_vagas(request):
+    """Exporta as vagas em CSV (streaming) ou XLSX no mesmo formato da importação"""
+    if not usuario_nos_grupos(request.user, GRUPOS_EXPORTACAO):
+        raise PermissionDenied("Você não tem permissão para acessar esta página.")
+    vagas = Spot.objects.all()
+    if request.GET.get('mostrar_inativas') != 'true':
+        vagas = vagas.filter(ativo=True)
+    secao_id = request.GET.get('secao')
+    if secao_id:
+        vagas = vagas.filter(secao_id=secao_id)
+    
+    nome_arquivo = f'vagas_{datetime.now().strftime("%Y%m%d_%H%M")}'
+    
+    if request.GET.get('formato') == 'xlsx':
+        arquivo = tempfile.TemporaryFile()
+        exportar_xlsx(vagas, arquivo)
+        arquivo.seek(0)
+        return FileResponse(
+            arquivo, as_attachment=True, filename=f'{nome_arquivo}.xlsx',
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+    
+    response = StreamingHttpResponse(exportar_csv(vagas), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nome_arquivo}.csv"'
+    return response
+
+@method_decorator(dados_versionados(secao_param=None), name='dispatch')
 class SpotDetailView(LoginRequiredMixin, TemplateView):
     template_name = 'secoes/spot_detail.html'
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        spot = get_object_or_404(Spot, pk=self.kwargs['pk'])
+        spot = obter_vaga(self.kwargs['pk'])
         context['spot'] = spot
         return context
 
 # Dashboard View
-class DashboardView(LoginRequiredMixin, TemplateView):
-    template_name = 'secoes/dashboard.html'
+
+CHAVE_CACHE_DASHBOARD = 'secoes:dashboard:estatisticas'
+VERSAO_CACHE_DASHBOARD = 2  # Incrementar ao mudar o formato do snapshot
+TEMPO_CACHE_DASHBOARD = 300  # Limita a defasagem dos contadores "últimos 7 dias"
+
+
+def consultas_dashboard():
+    """Agregações do dashboard: (vagas, seções, seções mais ocupadas).
+
+    Compartilhadas pelas versões síncrona e assíncrona; nada é executado aqui.
+    """
+    data_limite = timezone.now() - timedelta(days=7)
+    ocupada = Q(status='ocupada')
     
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        
-        # Estatísticas gerais
-        total_secoes = Section.objects.count()
-        total_vagas = Spot.objects.count()
-        vagas_ocupadas = Spot.objects.filter(status='ocupada').count()
-        
-        # Vagas configuradas a partir das seções
-        section_aggregates = Section.objects.aggregate(
-            sum_vcn=Sum('vagas_cobertas_nominadas'),
-            sum_vcnn=Sum('vagas_cobertas_nao_nominadas'),
-            sum_vdn=Sum('vagas_descobertas_nominadas'),
-            sum_vdnn=Sum('vagas_descobertas_nao_nominadas')
-        )
-        
-        vagas_configuradas_cobertas_nominadas = section_aggregates.get('sum_vcn') or 0
-        vagas_configuradas_cobertas_nao_nominadas = section_aggregates.get('sum_vcnn') or 0
-        vagas_configuradas_descobertas_nominadas = section_aggregates.get('sum_vdn') or 0
-        vagas_configuradas_descobertas_nao_nominadas = section_aggregates.get('sum_vdnn') or 0
-        
-        vagas_configuradas = (vagas_configuradas_cobertas_nominadas +
-                              vagas_configuradas_cobertas_nao_nominadas +
-                              vagas_configuradas_descobertas_nominadas +
-                              vagas_configuradas_descobertas_nao_nominadas)
-        
-        # Vagas disponíveis
-        vagas_disponiveis = vagas_configuradas - vagas_ocupadas
-        
-        # Estatísticas por tipo de vaga (baseado na configuração das seções)
-        vagas_cobertas = vagas_configuradas_cobertas_nominadas + vagas_configuradas_cobertas_nao_nominadas
-        vagas_descobertas = vagas_configuradas_descobertas_nominadas + vagas_configuradas_descobertas_nao_nominadas
-        vagas_nominadas = vagas_configuradas_cobertas_nominadas + vagas_configuradas_descobertas_nominadas
-        vagas_nao_nominadas = vagas_configuradas_cobertas_nao_nominadas + vagas_configuradas_descobertas_nao_nominadas
-        
-        # Vagas ocupadas por tipo
-        vagas_cobertas_ocupadas = Spot.objects.filter(tipo_cobertura='coberta', status='ocupada').count()
-        vagas_descobertas_ocupadas = Spot.objects.filter(tipo_cobertura='descoberta', status='ocupada').count()
-        vagas_nominadas_ocupadas = Spot.objects.filter(nominada='nominada', status='ocupada').count()
-        vagas_nao_nominadas_ocupadas = Spot.objects.filter(nominada='nao_nominada', status='ocupada').count()
-
-        # Percentual de utilização geral
-        percentual_utilizacao_geral = (vagas_ocupadas / vagas_configuradas * 100) if vagas_configuradas > 0 else 0
-        
-        # Outras estatísticas
-        def get_perc(part, total):
-            return (part / total * 100) if total > 0 else 0
-        
-        # Seções com mais vagas ocupadas
-        secoes_mais_ocupadas = Section.objects.annotate(
-            vagas_ocupadas=Count('vagas', filter=Q(vagas__status='ocupada'))
-        ).order_by('-vagas_ocupadas')[:5]
+    # Todos os contadores de vagas em uma única passada (COUNT ... FILTER)
+    vagas = dict(
+        total_vagas=Count('pk'),
+        vagas_ocupadas=Count('pk', filter=ocupada),
+        vagas_cobertas_ocupadas=Count('pk', filter=ocupada & Q(tipo_cobertura='coberta')),
+        vagas_descobertas_ocupadas=Count('pk', filter=ocupada & Q(tipo_cobertura='descoberta')),
+        vagas_nominadas_ocupadas=Count('pk', filter=ocupada & Q(nominada='nominada')),
+        vagas_nao_nominadas_ocupadas=Count('pk', filter=ocupada & Q(nominada='nao_nominada')),
+        vagas_ocupadas_recentes=Count('pk', filter=ocupada & Q(data_ocupacao__gte=data_limite)),
+        vagas_liberadas_recentes=Count('pk', filter=Q(status='livre', data_saida__gte=data_limite)),
+    )
+    
+    # Vagas configuradas a partir das seções
+    secoes = dict(
+        total_secoes=Count('pk'),
+        sum_vcn=Sum('vagas_cobertas_nominadas'),
+        sum_vcnn=Sum('vagas_cobertas_nao_nominadas'),
+        sum_vdn=Sum('vagas_descobertas_nominadas'),
+        sum_vdnn=Sum('vagas_descobertas_nao_nominadas')
+    )
+    
+    # Seções com mais vagas ocupadas (valores simples para caber no cache)
+    secoes_mais_ocupadas = Section.objects.annotate(
+        vagas_ocupadas=Count('vagas', filter=Q(vagas__status='ocupada'))
+    ).order_by('-vagas_ocupadas').values('id', 'nome', 'vagas_ocupadas')[:5]
+    
+    return vagas, secoes, secoes_mais_ocupadas
+
+
+def montar_estatisticas_dashboard(vagas, secoes, secoes_mais_ocupadas):
+    return {
+        **vagas,
+        'total_secoes': secoes['total_secoes'],
+        'vagas_configuradas_cobertas_nominadas': secoes.get('sum_vcn') or 0,
+        'vagas_configuradas_cobertas_nao_nominadas': secoes.get('sum_vcnn') or 0,
+        'vagas_configuradas_descobertas_nominadas': secoes.get('sum_vdn') or 0,
+        'vagas_configuradas_descobertas_nao_nominadas': secoes.get('sum_vdnn') or 0,
+        'secoes_mais_ocupadas': secoes_mais_ocupadas,
+    }
+
+
+def calcular_estatisticas_dashboard():
+    """Calcula os contadores do dashboard com uma agregação por tabela"""
+    vagas, secoes, secoes_mais_ocupadas = consultas_dashboard()
+    return montar_estatisticas_dashboard(
+        Spot.objects.aggregate(**vagas),
+        Section.objects.aggregate(**secoes),
+        list(secoes_mais_ocupadas),
+    )
+
+
+def obter_estatisticas_dashboard():
+    """Lê o snapshot das estatísticas do cache, recalculando se necessário"""
+    estatisticas = cache.get(CHAVE_CACHE_DASHBOARD, version=VERSAO_CACHE_DASHBOARD)
+    if estatisticas is None:
+        estatisticas = calcular_estatisticas_dashboard()
+        cache.set(CHAVE_CACHE_DASHBOARD, estatisticas, TEMPO_CACHE_DASHBOARD, version=VERSAO_CACHE_DASHBOARD)
+    return estatisticas
+
+
+def descartar_estatisticas_dashboard():
+    cache.delete(CHAVE_CACHE_DASHBOARD, version=VERSAO_CACHE_DASHBOARD)
+    cache.delete_many([CHAVE_CACHE_TENDENCIA % dias for dias in PERIODOS_TENDENCIA], version=VERSAO_CACHE_DASHBOARD)
+
+
+@receiver([post_save, post_delete], sender=Spot, dispatch_uid='secoes_dashboard_spot')
+@receiver([post_save, post_delete], sender=Section, dispatch_uid='secoes_dashboard_section')
+@receiver(dados_alterados, dispatch_uid='secoes_dashboard_lote')
+def invalidar_estatisticas_dashboard(sender, **kwargs):
+    """Descarta o snapshot do dashboard (após o commit) sempre que uma vaga ou seção muda,
+    inclusive em gravações em lote, restauração e manutenção"""
+    transaction.on_commit(descartar_estatisticas_dashboard)
+
+
+# Tendências de ocupação (aproximadas)
+#
+# Não há histórico de movimentações: cada vaga guarda apenas a data da
+# ocupação atual e a da última saída, que é sobrescrita a cada liberação.
+# Ciclos anteriores de uma mesma vaga se perdem, então as séries mostram só
+# o último movimento de cada vaga e subestimam a rotatividade.
+
+CHAVE_CACHE_TENDENCIA = 'secoes:dashboard:tendencia_aproximada:%d'
+PERIODOS_TENDENCIA = (7, 30, 365)
+
+
+def calcular_tendencia_aproximada(dias):
+    """Últimas ocupações e saídas por dia, seção e tipo de vaga nos últimos `dias` dias.
+
+    Cada série vem de uma única consulta agrupada por dia (GROUP BY) sobre
+    data_ocupacao e data_saida; veja a limitação acima.
+    """
+    hoje = timezone.localdate()
+    inicio = hoje - timedelta(days=dias - 1)
+    inicio_datahora = timezone.make_aware(datetime.combine(inicio, datetime.min.time()))
+    indice_dia = {(inicio + timedelta(days=n)).isoformat(): n for n in range(dias)}
+    
+    tendencia = {
+        'aproximada': True,
+        'dias': list(indice_dia),
+        'ocupacoes': [0] * dias,
+        'saidas': [0] * dias,
+        'por_secao': {},
+        'por_tipo': {},
+    }
+    
+    series = (('ocupacoes', 'data_ocupacao'), ('saidas', 'data_saida'))
+    for serie, campo in series:
+        linhas = Spot.objects.filter(**{f'{campo}__gte': inicio_datahora}).annotate(
+            dia=TruncDate(campo)
+        ).values('dia', 'secao__nome', 'tipo_cobertura', 'nominada').annotate(total=Count('pk'))
         
-        # Vagas ocupadas recentemente (últimos 7 dias)
-        data_limite = datetime.now() - timedelta(days=7)
-        vagas_ocupadas_recentes = Spot.objects.filter(
-            status='ocupada',
-            data_ocupacao__gte=data_limite
-        ).count()
+        for linha in linhas:
+            n = indice_dia.get(linha['dia'].isoformat())
+            if n is None:
+                continue
+            tendencia[serie][n] += linha['total']
+            for grupo, chave in (('por_secao', linha['secao__nome']),
+                                 ('por_tipo', f"{linha['tipo_cobertura']}_{linha['nominada']}")):
+                valores = tendencia[grupo].setdefault(chave, {'ocupacoes': [0] * dias, 'saidas': [0] * dias})
+                valores[serie][n] += linha['total']
+    
+    return tendencia
+
+
+def obter_tendencia_aproximada(dias):
+    """Tendência em cache, invalidada junto com o snapshot do dashboard"""
+    chave = CHAVE_CACHE_TENDENCIA % dias
+    tendencia = cache.get(chave, version=VERSAO_CACHE_DASHBOARD)
+    if tendencia is None:
+        tendencia = calcular_tendencia_aproximada(dias)
+        cache.set(chave, tendencia, TEMPO_CACHE_DASHBOARD, version=VERSAO_CACHE_DASHBOARD)
+    return tendencia
+
+
+@login_required
+def tendencia_ocupacao_aproximada(request):
+    """Séries aproximadas de ocupação para gráficos (JSON); ?dias=7, 30 ou 365"""
+    try:
+        dias = int(request.GET.get('dias', 7))
+    except ValueError:
+        dias = 7
+    if dias not in PERIODOS_TENDENCIA:
+        dias = 7
+    return JsonResponse(obter_tendencia_aproximada(dias))
+
+
+def periodo_dashboard(request):
+    """Intervalo de tempo atual: os contadores "últimos 7 dias" mudam sem gravações"""
+    return int(timezone.now().timestamp() // TEMPO_CACHE_DASHBOARD)
+
+
+def contexto_dashboard(estatisticas):
+    """Contexto do template do dashboard a partir do snapshot das estatísticas"""
+    vagas_ocupadas = estatisticas['vagas_ocupadas']
+    
+    vagas_configuradas_cobertas_nominadas = estatisticas['vagas_configuradas_cobertas_nominadas']
+    vagas_configuradas_cobertas_nao_nominadas = estatisticas['vagas_configuradas_cobertas_nao_nominadas']
+    vagas_configuradas_descobertas_nominadas = estatisticas['vagas_configuradas_descobertas_nominadas']
+    vagas_configuradas_descobertas_nao_nominadas = estatisticas['vagas_configuradas_descobertas_nao_nominadas']
+    
+    vagas_configuradas = (vagas_configuradas_cobertas_nominadas +
+                          vagas_configuradas_cobertas_nao_nominadas +
+                          vagas_configuradas_descobertas_nominadas +
+                          vagas_configuradas_descobertas_nao_nominadas)
+    
+    # Vagas disponíveis
+    vagas_disponiveis = vagas_configuradas - vagas_ocupadas
+    
+    # Estatísticas por tipo de vaga (baseado na configuração das seções)
+    vagas_cobertas = vagas_configuradas_cobertas_nominadas + vagas_configuradas_cobertas_nao_nominadas
+    vagas_descobertas = vagas_configuradas_descobertas_nominadas + vagas_configuradas_descobertas_nao_nominadas
+    vagas_nominadas = vagas_configuradas_cobertas_nominadas + vagas_configuradas_descobertas_nominadas
+    vagas_nao_nominadas = vagas_configuradas_cobertas_nao_nominadas + vagas_configuradas_descobertas_nao_nominadas
+    
+    # Vagas ocupadas por tipo
+    vagas_cobertas_ocupadas = estatisticas['vagas_cobertas_ocupadas']
+    vagas_descobertas_ocupadas = estatisticas['vagas_descobertas_ocupadas']
+    vagas_nominadas_ocupadas = estatisticas['vagas_nominadas_ocupadas']
+    vagas_nao_nominadas_ocupadas = estatisticas['vagas_nao_nominadas_ocupadas']
+
+    # Percentual de utilização geral
+    percentual_utilizacao_geral = (vagas_ocupadas / vagas_configuradas * 100) if vagas_configuradas > 0 else 0
+    
+    # Outras estatísticas
+    def get_perc(part, total):
+        return (part / total * 100) if total > 0 else 0
+    
+    return {
+        'total_secoes': estatisticas['total_secoes'],
+        'total_vagas': estatisticas['total_vagas'],
+        'vagas_ocupadas': vagas_ocupadas,
+        'vagas_disponiveis': vagas_disponiveis,
+        'vagas_configuradas': vagas_configuradas,
+        'percentual_utilizacao_geral': round(percentual_utilizacao_geral, 1),
         
-        # Vagas liberadas recentemente (últimos 7 dias)
-        vagas_liberadas_recentes = Spot.objects.filter(
-            status='livre'
-        ).count()
+        # Estatísticas por tipo
+        'vagas_cobertas': vagas_cobertas,
+        'vagas_descobertas': vagas_descobertas,
+        'vagas_nominadas': vagas_nominadas,
+        'vagas_nao_nominadas': vagas_nao_nominadas,
+        'vagas_cobertas_ocupadas': vagas_cobertas_ocupadas,
+        'vagas_descobertas_ocupadas': vagas_descobertas_ocupadas,
+        'vagas_nominadas_ocupadas': vagas_nominadas_ocupadas,
+        'vagas_nao_nominadas_ocupadas': vagas_nao_nominadas_ocupadas,
         
-        context.update({
-            'total_secoes': total_secoes,
-            'total_vagas': total_vagas,
-            'vagas_ocupadas': vagas_ocupadas,
-            'vagas_disponiveis': vagas_disponiveis,
-            'vagas_configuradas': vagas_configuradas,
-            'percentual_utilizacao_geral': round(percentual_utilizacao_geral, 1),
-            
-            # Estatísticas por tipo
-            'vagas_cobertas': vagas_cobertas,
-            'vagas_descobertas': vagas_descobertas,
-            'vagas_nominadas': vagas_nominadas,
-            'vagas_nao_nominadas': vagas_nao_nominadas,
-            'vagas_cobertas_ocupadas': vagas_cobertas_ocupadas,
-            'vagas_descobertas_ocupadas': vagas_descobertas_ocupadas,
-            'vagas_nominadas_ocupadas': vagas_nominadas_ocupadas,
-            'vagas_nao_nominadas_ocupadas': vagas_nao_nominadas_ocupadas,
-            
-            # Percentuais
-            'perc_cobertas': round(get_perc(vagas_cobertas_ocupadas, vagas_cobertas), 1),
-            'perc_descobertas': round(get_perc(vagas_descobertas_ocupadas, vagas_descobertas), 1),
-            'perc_nominadas': round(get_perc(vagas_nominadas_ocupadas, vagas_nominadas), 1),
-            'perc_nao_nominadas': round(get_perc(vagas_nao_nominadas_ocupadas, vagas_nao_nominadas), 1),
-            
-            # Dados para gráficos
-            'secoes_mais_ocupadas': secoes_mais_ocupadas,
-            'vagas_ocupadas_recentes': vagas_ocupadas_recentes,
-            'vagas_liberadas_recentes': vagas_liberadas_recentes,
-        })
+        # Percentuais
+        'perc_cobertas': round(get_perc(vagas_cobertas_ocupadas, vagas_cobertas), 1),
+        'perc_descobertas': round(get_perc(vagas_descobertas_ocupadas, vagas_descobertas), 1),
+        'perc_nominadas': round(get_perc(vagas_nominadas_ocupadas, vagas_nominadas), 1),
+        'perc_nao_nominadas': round(get_perc(vagas_nao_nominadas_ocupadas, vagas_nao_nominadas), 1),
         
+        # Dados para gráficos
+        'secoes_mais_ocupadas': estatisticas['secoes_mais_ocupadas'],
+        'vagas_ocupadas_recentes': estatisticas['vagas_ocupadas_recentes'],
+        'vagas_liberadas_recentes': estatisticas['vagas_liberadas_recentes'],
+    }
+
+
+@method_decorator(dados_versionados(secao_param=None, extra=periodo_dashboard), name='dispatch')
+class DashboardView(LoginRequiredMixin, TemplateView):
+    template_name = 'secoes/dashboard.html'
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Estatísticas gerais (snapshot em cache)
+        context.update(contexto_dashboard(obter_estatisticas_dashboard()))
         return context
 
 @login_required
@@ -356,26 +695,41 @@ def transferir_vaga(request, spot_id):
         if nova_secao_id:
             nova_secao = get_object_or_404(Section, pk=nova_secao_id)
             
-            # Verificar se o novo identificador já existe na nova seção
-            if novo_identificador:
-                vaga_existente = Spot.objects.filter(
-                    secao=nova_secao,
-                    identificador=novo_identificador,
-                    ativo=True
-                ).exclude(pk=spot.pk)
+            # Cota, identificador e gravação na mesma transação, com a seção de destino bloqueada
+            with transaction.atomic():
+                if spot.ativo and nova_secao.pk != spot.secao_id:
+                    try:
+                        reservar_vaga(nova_secao.pk, spot.tipo_cobertura, spot.nominada)
+                    except ValidationError as e:
+                        messages.error(request, e.messages[0])
+                        return render(request, 'secoes/transferir_vaga.html', {
+                            'spot': spot,
+                            'sections': secoes_cadastradas()
+                        })
                 
-                if vaga_existente.exists():
-                    messages.error(request, f'Já existe uma vaga com o identificador "{novo_identificador}" na seção {nova_secao.nome}.')
-                    return render(request, 'secoes/transferir_vaga.html', {
-                        'spot': spot,
-                        'sections': Section.objects.all()
-                    })
-            
-            # Realizar a transferência
-            spot.secao = nova_secao
-            if novo_identificador:
-                spot.identificador = novo_identificador
-            spot.save()
+                # Verificar se o novo identificador já existe na nova seção
+                if novo_identificador:
+                    vaga_existente = Spot.objects.filter(
+                        secao=nova_secao,
+                        identificador=novo_identificador,
+                        ativo=True
+                    ).exclude(pk=spot.pk)
+                    
+                    if vaga_existente.exists():
+                        messages.error(request, f'Já existe uma vaga com o identificador "{novo_identificador}" na seção {nova_secao.nome}.')
+                        return render(request, 'secoes/transferir_vaga.html', {
+                            'spot': spot,
+                            'sections': secoes_cadastradas()
+                        })
+                
+                # Realizar a transferência
+                secao_anterior = spot.secao_id
+                spot.secao = nova_secao
+                if novo_identificador:
+                    spot.identificador = novo_identificador
+                spot.save()
+            # A seção de origem também muda (o sinal só conhece a de destino)
+            marcar_alteracao(secao_anterior)
             
             messages.success(request, f'Vaga transferida com sucesso para {nova_secao.nome}!')
             return redirect('secoes:spot_detail', pk=spot.pk)
@@ -384,24 +738,84 @@ def transferir_vaga(request, spot_id):
     
     return render(request, 'secoes/transferir_vaga.html', {
         'spot': spot,
-        'sections': Section.objects.all()
+        'sections': secoes_cadastradas()
     })
 
 @login_required
-def historico_vagas(request):
-    """Lista o histórico de vagas transferidas e desativadas"""
-    # Buscar vagas inativas (histórico)
-    vagas_historico = Spot.objects.filter(
-        ativo=False
-    ).select_related('secao').order_by('-data_saida', '-data_ocupacao')
+def operacao_lote(request):
+    """Libera, desativa ou transfere várias vagas em uma única requisição (POST).
+
+    Parâmetros: acao (liberar, desativar ou transferir), vagas (ids, repetível)
+    e/ou filtros secao, tipo_cobertura, nominada e status; nova_secao para
+    transferir. Retorna o relatório por vaga em JSON.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'erro': 'Use POST.'}, status=405)
+    if not usuario_nos_grupos(request.user, ['admin', 'digitador']):
+        return JsonResponse({'erro': 'Você não tem permissão para esta operação.'}, status=403)
+    
+    acao = request.POST.get('acao')
+    operacao = OPERACOES.get(acao)
+    if operacao is None:
+        return JsonResponse({'erro': 'Ação inválida.'}, status=400)
+    
+    try:
+        ids = [int(pk) for pk in request.POST.getlist('vagas')]
+        queryset = selecionar_vagas(ids, **{campo: request.POST.get(campo) for campo in
+                                            ('secao', 'tipo_cobertura', 'nominada', 'status')})
+        if acao == 'transferir':
+            nova_secao_id = request.POST.get('nova_secao')
+            if not nova_secao_id:
+                return JsonResponse({'erro': 'Selecione uma seção para transferir as vagas.'}, status=400)
+            relatorio = operacao(queryset, get_object_or_404(Section, pk=nova_secao_id).pk, ids)
+        else:
+            relatorio = operacao(queryset, ids)
+    except (ValueError, SelecaoVaziaError) as e:
+        return JsonResponse({'erro': str(e)}, status=400)
+    
+    return JsonResponse({
+        'acao': acao,
+        'processadas': sum(1 for item in relatorio if item['resultado'] == 'ok'),
+        'vagas': relatorio,
+    })
+
+TAMANHO_PAGINA_HISTORICO = 50
+COLUNAS_HISTORICO = [
+    'id', 'secao', 'identificador', 'tipo', 'nome_bombeiro', 'posto_bombeiro', 'matricula_bombeiro',
+    'placa_veiculo', 'placa_veiculo_adicional', 'placa_moto', 'data_ocupacao', 'data_saida',
+]
+
+
+def intervalo_data_saida(data_inicio, data_fim):
+    """Filtro de data de saída entre dois dias (inclusive), no fuso local.
+
+    Compara a coluna com datetimes (>= início do primeiro dia e < início do
+    dia seguinte ao último) em vez de data_saida__date, para usar o índice.
+    """
+    filtro = Q()
+    try:
+        inicio = parse_date(data_inicio or '')
+        fim = parse_date(data_fim or '')
+    except ValueError:
+        return filtro
+    if inicio:
+        filtro &= Q(data_saida__gte=timezone.make_aware(datetime.combine(inicio, time.min)))
+    if fim:
+        filtro &= Q(data_saida__lt=timezone.make_aware(datetime.combine(fim + timedelta(days=1), time.min)))
+    return filtro
+
+
+def filtrar_historico(params):
+    """Vagas inativas conforme os filtros da página de histórico"""
+    vagas_historico = Spot.objects.filter(ativo=False)
     
     # Filtrar por seção se especificado
-    secao_id = request.GET.get('secao')
+    secao_id = params.get('secao')
     if secao_id:
         vagas_historico = vagas_historico.filter(secao_id=secao_id)
     
     # Filtrar por tipo de histórico
-    tipo_historico = request.GET.get('tipo')
+    tipo_historico = params.get('tipo')
     if tipo_historico == 'transferidas':
         # Vagas que foram transferidas (têm dados do bombeiro)
         vagas_historico = vagas_historico.filter(nome_bombeiro__isnull=False)
@@ -410,56 +824,239 @@ def historico_vagas(request):
         vagas_historico = vagas_historico.filter(nome_bombeiro__isnull=True)
     
     # Filtrar por data de saída
-    data_inicio = request.GET.get('data_inicio')
-    data_fim = request.GET.get('data_fim')
-    
-    if data_inicio:
-        vagas_historico = vagas_historico.filter(data_saida__date__gte=data_inicio)
-    
-    if data_fim:
-        vagas_historico = vagas_historico.filter(data_saida__date__lte=data_fim)
+    return vagas_historico.filter(intervalo_data_saida(params.get('data_inicio'), params.get('data_fim')))
+
+
+def codificar_cursor_historico(spot):
+    chave = [spot.data_saida.isoformat() if spot.data_saida else None, spot.pk]
+    return base64.urlsafe_b64encode(json.dumps(chave).encode()).decode()
+
+
+def decodificar_cursor_historico(cursor):
+    """Decodifica o cursor (data_saida, pk); retorna None se o valor for inválido"""
+    try:
+        data_saida, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if data_saida is not None:
+            data_saida = datetime.fromisoformat(data_saida)
+        return data_saida, int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def filtrar_cursor_historico(queryset, depois, antes):
+    """Ordena o histórico por data_saida desc (vazias por último), pk desc, a partir do cursor"""
+    if antes:
+        data_saida, pk = antes
+        if data_saida is None:
+            filtro = Q(data_saida__isnull=False) | Q(data_saida__isnull=True, pk__gt=pk)
+        else:
+            filtro = Q(data_saida__gt=data_saida) | Q(data_saida=data_saida, pk__gt=pk)
+        return queryset.filter(filtro).order_by(F('data_saida').asc(nulls_first=True), 'pk')
+    if depois:
+        data_saida, pk = depois
+        if data_saida is None:
+            filtro = Q(data_saida__isnull=True, pk__lt=pk)
+        else:
+            filtro = (Q(data_saida__lt=data_saida) | Q(data_saida=data_saida, pk__lt=pk) |
+                      Q(data_saida__isnull=True))
+        queryset = queryset.filter(filtro)
+    return queryset.order_by(F('data_saida').desc(nulls_last=True), '-pk')
+
+
+def agregados_historico():
+    """Total, transferidas e desativadas em uma única consulta (argumentos do aggregate)"""
+    return dict(
+        total=Count('pk'),
+        transferidas=Count('pk', filter=Q(nome_bombeiro__isnull=False)),
+        desativadas=Count('pk', filter=Q(nome_bombeiro__isnull=True)),
+    )
+
+
+def contexto_historico(request, page, totais, secoes):
+    # O template lê {{ vagas_historico.count }}: o total vem do aggregate
+    page.count = totais['total']
+    return {
+        'vagas_historico': page,
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+        # Filtros atuais para manter nos links de paginação e de exportação
+        'filtros_url': filtros_sem_cursor(request),
+        'sections': secoes,
+        'total_historico': totais['total'],
+        'vagas_transferidas': totais['transferidas'],
+        'vagas_desativadas': totais['desativadas'],
+        'secao_filtro': request.GET.get('secao'),
+        'tipo_filtro': request.GET.get('tipo'),
+    }
+
+
+@login_required
+@dados_versionados()
+def historico_vagas(request):
+    """Lista o histórico de vagas transferidas e desativadas"""
+    vagas_historico = filtrar_historico(request.GET)
     
-    # Estatísticas
-    total_historico = vagas_historico.count()
-    vagas_transferidas = vagas_historico.filter(nome_bombeiro__isnull=False).count()
-    vagas_desativadas = vagas_historico.filter(nome_bombeiro__isnull=True).count()
+    # Estatísticas em uma única consulta
+    totais = vagas_historico.aggregate(**agregados_historico())
     
-    context = {
-        'vagas_historico': vagas_historico,
-        'sections': Section.objects.all(),
-        'total_historico': total_historico,
-        'vagas_transferidas': vagas_transferidas,
-        'vagas_desativadas': vagas_desativadas,
-        'secao_filtro': secao_id,
-        'tipo_filtro': tipo_historico,
-    }
+    depois = decodificar_cursor_historico(request.GET.get('depois', ''))
+    antes = decodificar_cursor_historico(request.GET.get('antes', ''))
+    pagina = filtrar_cursor_historico(
+        vagas_historico.select_related('secao').prefetch_related(prefetch_termos()), depois, antes
+    )
+    page = montar_pagina(
+        list(pagina[:TAMANHO_PAGINA_HISTORICO + 1]), TAMANHO_PAGINA_HISTORICO,
+        depois, antes, codificar_cursor_historico,
+    )
     
+    context = contexto_historico(request, page, totais, secoes_cadastradas())
     return render(request, 'secoes/historico_vagas.html', context)
 
+
+def linhas_historico(queryset):
+    """Cabeçalho e linhas do histórico, com as datas no fuso local"""
+    yield COLUNAS_HISTORICO
+    linhas = queryset.annotate(
+        tipo=Case(When(nome_bombeiro__isnull=False, then=Value('transferida')), default=Value('desativada'))
+    ).order_by(F('data_saida').desc(nulls_last=True), '-pk').values_list(
+        'pk', 'secao__nome', 'identificador', 'tipo', 'nome_bombeiro', 'posto_bombeiro', 'matricula_bombeiro',
+        'placa_veiculo', 'placa_veiculo_adicional', 'placa_moto', 'data_ocupacao', 'data_saida',
+    ).iterator(chunk_size=1000)
+    for *dados, data_ocupacao, data_saida in linhas:
+        # O XLSX não aceita datetimes com fuso
+        yield dados + [
+            timezone.localtime(data).replace(tzinfo=None) if data else None
+            for data in (data_ocupacao, data_saida)
+        ]
+
+
 @login_required
-def gerar_termo_compromisso(request, spot_id):
-    """Gera o termo de compromisso em PDF para uma vaga específica"""
-    spot = get_object_or_404(Spot, pk=spot_id)
+def exportar_historico(request):
+    """Exporta o histórico filtrado em CSV (streaming) ou XLSX"""
+    if not usuario_nos_grupos(request.user, GRUPOS_EXPORTACAO):
+        raise PermissionDenied("Você não tem permissão para acessar esta página.")
+    vagas_historico = filtrar_historico(request.GET)
+    nome_arquivo = f'historico_vagas_{datetime.now().strftime("%Y%m%d_%H%M")}'
     
-    # Verificar se a vaga tem dados do bombeiro
-    if not spot.nome_bombeiro:
-        messages.error(request, 'Não é possível gerar o termo de compromisso para uma vaga sem dados do bombeiro.')
-        return redirect('secoes:spot_list')
+    if request.GET.get('formato') == 'xlsx':
+        arquivo = tempfile.TemporaryFile()
+        exportar_xlsx(vagas_historico, arquivo, linhas=linhas_historico, titulo='Histórico')
+        arquivo.seek(0)
+        return FileResponse(
+            arquivo, as_attachment=True, filename=f'{nome_arquivo}.xlsx',
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
     
-    # Função para converter data para extenso
-    def data_por_extenso(data_str):
-        from datetime import datetime
-        meses = [
-            'janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho',
-            'julho', 'agosto', 'setembro', 'outubro', 'novembro', 'dezembro'
-        ]
-        data = datetime.strptime(data_str, '%d/%m/%Y')
-        return f"{data.day} de {meses[data.month - 1]} de {data.year}"
+    response = StreamingHttpResponse(
+        exportar_csv(vagas_historico, linhas=linhas_historico), content_type='text/csv; charset=utf-8'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{nome_arquivo}.csv"'
+    return response
+
+# Geração de PDFs
+
+VERSAO_TEMPLATES_PDF = 4  # Incrementar ao alterar os templates dos PDFs
+ESPERA_PDF_SEGUNDOS = 2  # PDFs pequenos saem na própria requisição
+
+
+TAMANHO_PARTE_LISTA = 200  # Vagas por parte HTML na lista completa
+LOGO_RELATORIOS = 'cbmepi_logo.png'
+
+# Compilar os templates e carregar a logo uma vez por processo
+registro_relatorios.precarregar(
+    templates=['secoes/termo_compromisso.html', 'secoes/lista_vagas.html'],
+    imagens=[LOGO_RELATORIOS],
+)
+
+
+def data_documento(request):
+    """Data impressa nos PDFs: o documento muda de um dia para o outro"""
+    return datetime.now().strftime('%d/%m/%Y')
+
+
+def responder_pdf(request, chave, gerar_html, nome_arquivo, **kwargs):
+    """Serve o PDF do cache ou agenda a renderização e pede ao navegador para aguardar"""
+    caminho = fila_pdf.obter(chave)
+    if caminho is None:
+        try:
+            caminho = fila_pdf.aguardar(
+                chave, gerar_html,
+                getattr(settings, 'PDF_ESPERA_SEGUNDOS', ESPERA_PDF_SEGUNDOS),
+                **kwargs
+            )
+        except Exception:
+            # ValueError do xhtml2pdf, OSError ao gravar ou falha do processo de trabalho
+            logger.exception('Erro ao gerar o PDF %s', chave)
+            return HttpResponse('Erro ao gerar PDF', status=500)
+    
+    return resposta_pdf(caminho, nome_arquivo)
+
+
+def resposta_pdf(caminho, nome_arquivo):
+    if caminho is None:
+        # Ainda em processamento: o navegador recarrega a mesma URL
+        response = HttpResponse(
+            '<p>Gerando PDF, aguarde... Esta página será atualizada automaticamente.</p>',
+            status=202
+        )
+        response['Refresh'] = '2'
+        return response
+    
+    # Configurar a resposta HTTP para abrir inline
+    return FileResponse(open(caminho, 'rb'), content_type='application/pdf', filename=nome_arquivo)
+
+def gerar_partes_lista_vagas(vagas, context):
+    """Renderiza a lista por seção, em partes de até TAMANHO_PARTE_LISTA vagas.
+
+    Percorre o queryset com iterator() e grava cada parte em disco. O
+    cabeçalho sai só na primeira parte, o total e o rodapé só na última, e a
+    numeração continua de uma parte para a outra; para saber qual é a última,
+    a parte anterior só é gravada quando a seguinte começa (no máximo duas
+    partes em memória).
+    """
+    template = registro_relatorios.template('secoes/lista_vagas.html')
+    partes = []
+    numero_inicial = 0
+    
+    def gravar(bloco, tem_proxima_parte):
+        nonlocal numero_inicial
+        partes.append(fila_pdf.gravar_parte(template.render({
+            **context,
+            'vagas': bloco,
+            'numero_inicial': numero_inicial,
+            'parte_seguinte': bool(partes),
+            'tem_proxima_parte': tem_proxima_parte,
+        })))
+        numero_inicial += len(bloco)
     
-    # Carregar logo em base64
-    logo_path = os.path.join(settings.BASE_DIR, 'static', 'cbmepi_logo.png')
-    with open(logo_path, 'rb') as logo_file:
-        logo_base64 = base64.b64encode(logo_file.read()).decode()
+    anterior, bloco = None, []
+    for vaga in vagas.iterator(chunk_size=TAMANHO_PARTE_LISTA):
+        if bloco and (vaga.secao_id != bloco[-1].secao_id or len(bloco) >= TAMANHO_PARTE_LISTA):
+            if anterior is not None:
+                gravar(anterior, True)
+            anterior, bloco = bloco, []
+        bloco.append(vaga)
+    
+    if anterior is not None:
+        gravar(anterior, True)
+    # Sempre gerar ao menos uma parte, mesmo sem vagas ocupadas
+    gravar(bloco, False)
+    return partes
+
+def data_por_extenso(data_str):
+    """Converte dd/mm/aaaa para data por extenso"""
+    meses = [
+        'janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho',
+        'julho', 'agosto', 'setembro', 'outubro', 'novembro', 'dezembro'
+    ]
+    data = datetime.strptime(data_str, '%d/%m/%Y')
+    return f"{data.day} de {meses[data.month - 1]} de {data.year}"
+
+
+def preparar_termo(spot):
+    """Chave do cache, gerador do HTML e nome do arquivo do termo da vaga"""
+    # Carregar logo em base64 (em cache no processo)
+    logo_base64 = registro_relatorios.imagem_base64(LOGO_RELATORIOS)
     
     # Dados para o template
     data_atual = datetime.now().strftime('%d/%m/%Y')
@@ -471,23 +1068,32 @@ def gerar_termo_compromisso(request, spot_id):
         'logo_base64': logo_base64,
     }
     
-    # Renderizar o template HTML
-    template = get_template('secoes/termo_compromisso.html')
-    html = template.render(context)
+    # O termo muda quando mudam os dados da vaga ou a data do documento
+    template_name = 'secoes/termo_compromisso.html'
+    dados_vaga = [(f.attname, f.value_from_object(spot)) for f in spot._meta.concrete_fields]
+    chave = chave_pdf(template_name, VERSAO_TEMPLATES_PDF, data_atual, spot.secao.nome, dados_vaga)
     
-    # Criar o PDF
-    result = BytesIO()
-    pdf = pisa.CreatePDF(html, result)
+    return (
+        chave,
+        lambda: registro_relatorios.template(template_name).render(context),
+        f'termo_compromisso_{spot.identificador}.pdf',
+    )
+
+@login_required
+@dados_versionados(secao_param=None, extra=data_documento)
+def gerar_termo_compromisso(request, spot_id):
+    """Gera o termo de compromisso em PDF para uma vaga específica"""
+    spot = obter_vaga(spot_id)
     
-    if not pdf.err:
-        # Configurar a resposta HTTP para abrir inline
-        response = HttpResponse(result.getvalue(), content_type='application/pdf')
-        response['Content-Disposition'] = f'inline; filename="termo_compromisso_{spot.identificador}.pdf"'
-        return response
+    # Verificar se a vaga tem dados do bombeiro
+    if not spot.nome_bombeiro:
+        messages.error(request, 'Não é possível gerar o termo de compromisso para uma vaga sem dados do bombeiro.')
+        return redirect('secoes:spot_list')
     
-    return HttpResponse('Erro ao gerar PDF', status=500)
+    return responder_pdf(request, *preparar_termo(spot))
 
 @login_required
+@dados_versionados(secao_param=None, extra=data_documento)
 def gerar_lista_vagas(request):
     """Gera a lista completa de vagas com dados dos militares, seções e veículos"""
     # Buscar todas as vagas ocupadas com dados completos
@@ -495,65 +1101,46 @@ def gerar_lista_vagas(request):
         status='ocupada'
     ).select_related('secao').order_by('secao__nome', 'nome_bombeiro')
     
-    # Buscar logo em base64 de forma robusta para dev e prod
-    logo_base64 = ""
-    logo_filename = 'cbmepi_logo.png'
-
-    # Tenta encontrar a logo nos diretórios de staticfiles
-    logo_path = None
-    if hasattr(settings, 'STATICFILES_DIRS'):
-        for static_dir in settings.STATICFILES_DIRS:
-            possible_path = os.path.join(static_dir, logo_filename)
-            if os.path.exists(possible_path):
-                logo_path = possible_path
-                break
-
-    # Se não achou, tenta na pasta static do projeto
-    if not logo_path:
-        logo_path = os.path.join(settings.BASE_DIR, 'static', logo_filename)
-        if not os.path.exists(logo_path):
-            logo_path = None
-
-    if logo_path:
-        with open(logo_path, 'rb') as logo_file:
-            logo_base64 = base64.b64encode(logo_file.read()).decode('utf-8')
+    # Buscar logo em base64 (em cache no processo)
+    logo_base64 = registro_relatorios.imagem_base64(LOGO_RELATORIOS)
     
-    # Dados para o template
+    # Dados para o template (total_vagas só é contado se o PDF for gerado)
     context = {
         'vagas': vagas,
         'data_atual': datetime.now().strftime('%d/%m/%Y'),
-        'hora_atual': datetime.now().strftime('%H:%M'),
-        'total_vagas': vagas.count(),
         'logo_base64': logo_base64,
     }
     
-    # Renderizar o template HTML
-    template = get_template('secoes/lista_vagas.html')
-    html = template.render(context)
+    # A lista muda quando muda qualquer vaga ou seção (versão dos dados) ou a
+    # data do documento: a chave sai do cache, sem percorrer as vagas. O
+    # documento não traz a hora, que ficaria parada no PDF em cache
+    template_name = 'secoes/lista_vagas.html'
+    chave = chave_pdf(template_name, VERSAO_TEMPLATES_PDF, context['data_atual'], versao_dados())
     
-    # Criar o PDF
-    result = BytesIO()
-    pdf = pisa.CreatePDF(html, result)
-    
-    if not pdf.err:
-        # Configurar a resposta HTTP para abrir inline
-        response = HttpResponse(result.getvalue(), content_type='application/pdf')
-        response['Content-Disposition'] = f'inline; filename="lista_vagas_{datetime.now().strftime("%Y%m%d_%H%M")}.pdf"'
-        return response
-    
-    return HttpResponse('Erro ao gerar PDF', status=500)
+    return responder_pdf(
+        request, chave,
+        lambda: gerar_partes_lista_vagas(vagas, {**context, 'total_vagas': vagas.count()}),
+        f'lista_vagas_{datetime.now().strftime("%Y%m%d_%H%M")}.pdf',
+        renderizar=renderizar_partes_em_arquivo
+    )
 
 @login_required
 def upload_termo_compromisso_vaga(request, spot_id):
     """Upload do termo de compromisso assinado para uma vaga específica"""
-    spot = get_object_or_404(Spot, pk=spot_id)
+    spot = obter_vaga(spot_id)
     
     if request.method == 'POST':
         form = TermoCompromissoForm(request.POST, request.FILES)
         if form.is_valid():
             termo = form.save(commit=False)
             termo.spot = spot
-            termo.save()
+            # Gravar o arquivo fora da transação
+            armazenar_documento(termo)
+            
+            with transaction.atomic():
+                termo.numero_documento = numerar_documento(spot)
+                termo.save()
+            
             messages.success(request, f'Termo de Compromisso {termo.numero_documento} enviado com sucesso!')
             return redirect('secoes:spot_list')
     else:
@@ -567,3 +1154,21 @@ def upload_termo_compromisso_vaga(request, spot_id):
         'spot': spot,
         'termos_existentes': termos_existentes
     })
+
+class DesempenhoView(LoginRequiredMixin, GroupRequiredMixin, TemplateView):
+    """Estatísticas de desempenho acumuladas neste processo (apenas admin)"""
+    template_name = 'secoes/desempenho.html'
+    allowed_groups = ['admin']
+
+    def post(self, request, *args, **kwargs):
+        estatisticas.limpar()
+        messages.success(request, 'Estatísticas de desempenho zeradas.')
+        return redirect('secoes:desempenho')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['views'] = estatisticas.resumo()
+        context['lentas'] = list(estatisticas.lentas)
+        context['relatorios'] = registro_relatorios.estatisticas
+        context['limite_lenta'] = getattr(settings, 'PERF_LIMITE_LENTA', 1.0)
+        return context
@@ -0,0 +1,191 @@
+"""Versões assíncronas das páginas de leitura, para o modo ASGI.
+
+Usam a API assíncrona do ORM e do cache (aaggregate, aget, async for), de
+modo que um worker ASGI atende vários terminais enquanto espera o banco. A
+renderização dos templates roda em thread (sync_to_async) e o PDF continua no
+pool de processos da fila_pdf, com a espera feita sem bloquear o event loop.
+
+Cada view reaproveita os filtros, cursores e contextos das views síncronas;
+no urls.py elas substituem as síncronas quando o projeto é servido pelo ASGI:
+
+    path('dashboard/', views_async.dashboard, name='dashboard'),
+    path('vagas/', views_async.spot_list, name='spot_list'),
+    path('vagas/<int:pk>/', views_async.spot_detail, name='spot_detail'),
+    path('vagas/historico/', views_async.historico_vagas, name='historico_vagas'),
+    path('vagas/<int:spot_id>/termo/', views_async.gerar_termo_compromisso, name='gerar_termo'),
+    path('vagas/ao-vivo/', views_async.feed_ocupacao, name='feed_ocupacao'),
+
+O feed SSE (feed_ocupacao) existe apenas no modo ASGI: no WSGI cada tela
+conectada ocuparia uma thread.
+"""
+import asyncio
+import json
+import logging
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import redirect, render
+
+from .cache_modelos import aobter_vaga, asecoes_cadastradas
+from .condicional import dados_versionados
+from .eventos import canal_ocupacao
+from .models import Section, Spot
+from .pdfs import fila_pdf
+from .views import (
+    CHAVE_CACHE_DASHBOARD, ESPERA_PDF_SEGUNDOS, TAMANHO_PAGINA_HISTORICO, TEMPO_CACHE_DASHBOARD,
+    VERSAO_CACHE_DASHBOARD, SpotListView, agregados_historico, codificar_cursor, codificar_cursor_historico,
+    consultas_dashboard, contexto_dashboard, contexto_historico, data_documento, decodificar_cursor,
+    decodificar_cursor_historico, filtrar_cursor_historico, filtrar_cursor_vagas, filtrar_historico,
+    filtros_sem_cursor, montar_estatisticas_dashboard, montar_pagina, periodo_dashboard, prefetch_termos,
+    preparar_termo, resposta_pdf,
+)
+
+logger = logging.getLogger(__name__)
+
+arender = sync_to_async(render)
+
+INTERVALO_HEARTBEAT = 15  # segundos; mantém a conexão aberta em proxies
+RECONEXAO_MS = 5000
+
+
+def login_obrigatorio(view):
+    """login_required para views assíncronas (request.auser())"""
+    @wraps(view)
+    async def _view(request, *args, **kwargs):
+        usuario = await request.auser()
+        if not usuario.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return _view
+
+
+async def aobter_estatisticas_dashboard():
+    """Versão assíncrona de obter_estatisticas_dashboard()"""
+    estatisticas = await cache.aget(CHAVE_CACHE_DASHBOARD, version=VERSAO_CACHE_DASHBOARD)
+    if estatisticas is None:
+        vagas, secoes, secoes_mais_ocupadas = consultas_dashboard()
+        estatisticas = montar_estatisticas_dashboard(
+            await Spot.objects.aaggregate(**vagas),
+            await Section.objects.aaggregate(**secoes),
+            [secao async for secao in secoes_mais_ocupadas],
+        )
+        await cache.aset(CHAVE_CACHE_DASHBOARD, estatisticas, TEMPO_CACHE_DASHBOARD, version=VERSAO_CACHE_DASHBOARD)
+    return estatisticas
+
+
+@login_obrigatorio
+@dados_versionados(secao_param=None, extra=periodo_dashboard)
+async def dashboard(request):
+    context = contexto_dashboard(await aobter_estatisticas_dashboard())
+    return await arender(request, 'secoes/dashboard.html', context)
+
+
+@login_obrigatorio
+@dados_versionados()
+async def spot_list(request):
+    vista = SpotListView()
+    vista.setup(request)
+    depois = decodificar_cursor(request.GET.get('depois', ''))
+    antes = decodificar_cursor(request.GET.get('antes', ''))
+
+    # Mesmo queryset da view síncrona, lido com um registro a mais
+    # get_queryset pode consultar o banco (pesquisa por placa completa)
+    queryset = filtrar_cursor_vagas(await sync_to_async(vista.get_queryset)(), depois, antes)
+    queryset = queryset[:vista.paginate_by + 1]
+    page = montar_pagina([vaga async for vaga in queryset], vista.paginate_by, depois, antes, codificar_cursor)
+
+    context = {
+        'spots': page.object_list,
+        'object_list': page.object_list,
+        'page_obj': page,
+        'paginator': None,
+        'is_paginated': page.has_other_pages(),
+        'sections': await asecoes_cadastradas(),
+        'mostrar_inativas': request.GET.get('mostrar_inativas') == 'true',
+        'pesquisa': request.GET.get('pesquisa', ''),
+        'filtros_url': filtros_sem_cursor(request),
+    }
+    return await arender(request, 'secoes/spot_list.html', context)
+
+
+@login_obrigatorio
+@dados_versionados(secao_param=None)
+async def spot_detail(request, pk):
+    return await arender(request, 'secoes/spot_detail.html', {'spot': await aobter_vaga(pk)})
+
+
+@login_obrigatorio
+@dados_versionados()
+async def historico_vagas(request):
+    vagas_historico = filtrar_historico(request.GET)
+    totais = await vagas_historico.aaggregate(**agregados_historico())
+
+    depois = decodificar_cursor_historico(request.GET.get('depois', ''))
+    antes = decodificar_cursor_historico(request.GET.get('antes', ''))
+    queryset = filtrar_cursor_historico(
+        vagas_historico.select_related('secao').prefetch_related(prefetch_termos()), depois, antes
+    )
+    registros = [vaga async for vaga in queryset[:TAMANHO_PAGINA_HISTORICO + 1]]
+    page = montar_pagina(registros, TAMANHO_PAGINA_HISTORICO, depois, antes, codificar_cursor_historico)
+
+    context = contexto_historico(request, page, totais, await asecoes_cadastradas())
+    return await arender(request, 'secoes/historico_vagas.html', context)
+
+
+@login_obrigatorio
+@dados_versionados(secao_param=None, extra=data_documento)
+async def gerar_termo_compromisso(request, spot_id):
+    spot = await aobter_vaga(spot_id)
+    if not spot.nome_bombeiro:
+        messages.error(request, 'Não é possível gerar o termo de compromisso para uma vaga sem dados do bombeiro.')
+        return redirect('secoes:spot_list')
+
+    chave, gerar_html, nome_arquivo = preparar_termo(spot)
+    caminho = fila_pdf.obter(chave)
+    if caminho is None:
+        try:
+            caminho = await fila_pdf.aaguardar(
+                chave, gerar_html, getattr(settings, 'PDF_ESPERA_SEGUNDOS', ESPERA_PDF_SEGUNDOS)
+            )
+        except Exception:
+            logger.exception('Erro ao gerar o PDF %s', chave)
+            return HttpResponse('Erro ao gerar PDF', status=500)
+    return resposta_pdf(caminho, nome_arquivo)
+
+
+def _evento_sse(evento):
+    dados = {chave: valor for chave, valor in evento.items() if chave not in ('id', 'tipo')}
+    return f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {json.dumps(dados, separators=(',', ':'))}\n\n"
+
+
+@login_obrigatorio
+async def feed_ocupacao(request):
+    """Server-sent events com as mudanças de status das vagas (?secao= filtra, repetível)"""
+    secoes = {int(secao) for secao in request.GET.getlist('secao') if secao.isdigit()}
+    assinatura, pendentes = canal_ocupacao.assinar(secoes, request.headers.get('Last-Event-ID'))
+
+    async def fluxo():
+        try:
+            yield f'retry: {RECONEXAO_MS}\n\n'
+            for evento in pendentes:
+                yield _evento_sse(evento)
+            while True:
+                try:
+                    evento = await asyncio.wait_for(assinatura.fila.get(), INTERVALO_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                yield _evento_sse(evento)
+        finally:
+            # Conexão encerrada pelo cliente (a tarefa é cancelada)
+            canal_ocupacao.cancelar(assinatura)
+
+    response = StreamingHttpResponse(fluxo(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: não acumular o stream
+    return response